@@ -2,6 +2,7 @@
 
 
 from Missions.mission import Mission
+from observation import entity_index
 import random
 import math
 
@@ -73,29 +74,26 @@ class EnemyMission(Mission):
             </Mission>'''
     
     def chat_command_init(self,shoot_agent, move_agent, params):
-        shoot_agent.commands.append((shoot_agent.agent, "chat /kill @e[type=!player]", 0))
-        shoot_agent.commands.append((shoot_agent.agent, "hotbar.1 1", 0))
-        shoot_agent.commands.append((shoot_agent.agent, "hotbar.1 0", 0))
+        shoot_agent.commands.schedule("chat /kill @e[type=!player]", 0)
+        shoot_agent.commands.schedule("hotbar.1 1", 0)
+        shoot_agent.commands.schedule("hotbar.1 0", 0)
 
-        move_agent.commands.append((move_agent.agent, "chat /gamemode 3", 0))
-        move_agent.commands.append((move_agent.agent, "jump 1", 0))
-        move_agent.commands.append((move_agent.agent, "jump 0", params[2]))
-        move_agent.commands.append((move_agent.agent, "chat /gamemode 1", params[2]))
+        move_agent.commands.schedule("chat /gamemode 3", 0)
+        move_agent.commands.schedule("jump 1", 0)
+        move_agent.commands.schedule("jump 0", params[2])
+        move_agent.commands.schedule("chat /gamemode 1", params[2])
 
         enemy = random.choice(self.enemy_types)
         spawn_loc = (params[0],params[1])
-        shoot_agent.commands.append((shoot_agent.agent, "chat /summon {} ~{} ~0 ~{}".format(enemy, spawn_loc[0],spawn_loc[1]), 0))
-        shoot_agent.commands.append((shoot_agent.agent, "chat /summon {} ~{} ~0 ~{}".format(enemy, spawn_loc[0]*1.2,spawn_loc[1]*1.2), 0))
-        shoot_agent.commands.append((shoot_agent.agent, "chat /summon {} ~{} ~0 ~{}".format(enemy, spawn_loc[0]*1,spawn_loc[1]*1.4), 0))
-        shoot_agent.commands.append((shoot_agent.agent, "chat /summon {} ~{} ~0 ~{}".format(enemy, spawn_loc[0]*1.4,spawn_loc[1]*1), 0))
+        shoot_agent.commands.schedule("chat /summon {} ~{} ~0 ~{}".format(enemy, spawn_loc[0],spawn_loc[1]), 0)
+        shoot_agent.commands.schedule("chat /summon {} ~{} ~0 ~{}".format(enemy, spawn_loc[0]*1.2,spawn_loc[1]*1.2), 0)
+        shoot_agent.commands.schedule("chat /summon {} ~{} ~0 ~{}".format(enemy, spawn_loc[0]*1,spawn_loc[1]*1.4), 0)
+        shoot_agent.commands.schedule("chat /summon {} ~{} ~0 ~{}".format(enemy, spawn_loc[0]*1.4,spawn_loc[1]*1), 0)
 
 
 
     def get_target(self, entities):
-      for entity in entities:
-          if entity["name"] in self.enemy_types:
-              return entity
-      return None
+      return entity_index(entities).first_named(self.enemy_types)
 
     def ai_step(self, move_agent, target_transform):
         if move_agent is None or target_transform is None:
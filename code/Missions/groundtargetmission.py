@@ -82,15 +82,15 @@ class GroundTargetMission(Mission):
             </Mission>'''
    
     def chat_command_init(self,shoot_agent, move_agent, params):
-        shoot_agent.commands.append((shoot_agent.agent, "chat /kill @e[type=!player]", 0))
-        shoot_agent.commands.append((shoot_agent.agent, "hotbar.1 1", 0))
-        shoot_agent.commands.append((shoot_agent.agent, "hotbar.1 0", 0))
+        shoot_agent.commands.schedule("chat /kill @e[type=!player]", 0)
+        shoot_agent.commands.schedule("hotbar.1 1", 0)
+        shoot_agent.commands.schedule("hotbar.1 0", 0)
         speed = random.random()
         magnitude = -1 if random.random() > 0.5 else 1
-        move_agent.commands.append((move_agent.agent, "strafe {}".format(str(speed*magnitude)), 0))
+        move_agent.commands.schedule("strafe {}".format(str(speed*magnitude)), 0)
         speed = random.random()
         magnitude = -1 if random.random() > 0.5 else 1
-        move_agent.commands.append((move_agent.agent, "move {}".format(str(speed*magnitude)), 0))
+        move_agent.commands.schedule("move {}".format(str(speed*magnitude)), 0)
 
 
 
@@ -1,8 +1,12 @@
 try:
     from malmo import MalmoPython
+    import malmo.minecraftbootstrap
 except:
-    import MalmoPython
-import malmo.minecraftbootstrap
+    try:
+        import MalmoPython
+    except ImportError:
+        #Without Malmo only the simulator backend is available
+        MalmoPython = None
 
 import os
 import sys
@@ -14,12 +18,15 @@ import numpy as np
 from matplotlib import pyplot as plt
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import PolynomialFeatures
+from observation import entity_index
 def fill_inventory():
     result = ""
     for i in range(36):
         result += "<InventoryItem slot=\"" + str(i) + "\" type=\"bow\" quantity=\"1\"/>\n"
     return result
 class Mission():
+    #Module providing AgentHost, MissionSpec, ClientPool... either MalmoPython or simulator
+    backend = MalmoPython
 
     '''
     Example:
@@ -99,7 +106,7 @@ class Mission():
         pass
 
     def one_agent_init(self):
-        agent = MalmoPython.AgentHost()
+        agent = self.backend.AgentHost()
         try:
             agent.parse( sys.argv )
         except RuntimeError as e:
@@ -113,8 +120,8 @@ class Mission():
 
     def two_agent_init(self):
         # Create default Malmo objects:
-        agent1 = MalmoPython.AgentHost()
-        agent2 = MalmoPython.AgentHost()
+        agent1 = self.backend.AgentHost()
+        agent2 = self.backend.AgentHost()
         try:
             agent1.parse(sys.argv)
             agent2.parse(sys.argv)
@@ -131,22 +138,23 @@ class Mission():
             exit(0)
         return (agent1,agent2)
 
-    def load_duo_mission(self, mission, agents):
-        #agen
-        mission_record = MalmoPython.MissionRecordSpec()
+    def load_duo_mission(self, mission, agents, ports=(10001, 10002), experiment_id=""):
+        #ports are the control ports of the two clients.  Runs on several client pairs
+        #at once need distinct ports and experiment ids
+        mission_record = self.backend.MissionRecordSpec()
         mission.setViewpoint(0)
         # Attempt to start a mission:
         max_retries = 25
         #Quit out of currently running mission
         agents[0].sendCommand("quit")
         agents[1].sendCommand("quit")
-        clients = MalmoPython.ClientPool()
-        clients.add(MalmoPython.ClientInfo('127.0.0.1', 10001))
-        clients.add(MalmoPython.ClientInfo('127.0.0.1', 10002))
+        clients = self.backend.ClientPool()
+        for port in ports:
+            clients.add(self.backend.ClientInfo('127.0.0.1', port))
             
         for retry in range(max_retries):
             try:
-                agents[0].startMission( mission, clients, mission_record, 0, "")
+                agents[0].startMission( mission, clients, mission_record, 0, experiment_id)
                 break
             except RuntimeError as e:
                 print("Error starting mission", e)
@@ -157,7 +165,7 @@ class Mission():
 
         for retry in range(max_retries):
             try:
-                agents[1].startMission( mission, clients, mission_record, 1, "")
+                agents[1].startMission( mission, clients, mission_record, 1, experiment_id)
                 break
             except RuntimeError as e:
                 print("Error starting mission", e)
@@ -180,7 +188,7 @@ class Mission():
             if len(world_state.errors) > 0:
                 error_ticks += 1
             if error_ticks >= 5:
-                return self.load_duo_mission(mission,agents)
+                return self.load_duo_mission(mission,agents,ports,experiment_id)
             
 
            
@@ -189,12 +197,12 @@ class Mission():
         print("Mission running.")
 
     def load_solo_mission(self, mission, agent):
-        mission_record = MalmoPython.MissionRecordSpec()
+        mission_record = self.backend.MissionRecordSpec()
         mission.setViewpoint(0)
         
 
-        clients = MalmoPython.ClientPool()
-        clients.add(MalmoPython.ClientInfo('127.0.0.1', 10000)) # add Minecraft machines here as available
+        clients = self.backend.ClientPool()
+        clients.add(self.backend.ClientInfo('127.0.0.1', 10000)) # add Minecraft machines here as available
         #Quit from existing mission
         max_retries = 25
         #Quit out of currently running mission
@@ -231,10 +239,8 @@ class Mission():
         pass
 
     def get_target(self, entities):
-        for entity in entities:
-          if entity["name"] == "Mover":
-              return entity
-        return None
+        #entities can be a Frame, an EntityIndex or a list of entities
+        return entity_index(entities).first_named(["Mover"])
 
 
 
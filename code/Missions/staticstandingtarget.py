@@ -71,6 +71,6 @@ class StaticStandingTargetMission(Mission):
             </Mission>'''
     
     def chat_command_init(self, shoot_agent, move_agent, params):
-      shoot_agent.commands.append((shoot_agent.agent, "chat /kill @e[type=!player]", 0))
-      shoot_agent.commands.append((shoot_agent.agent, "hotbar.1 1", 0))
-      shoot_agent.commands.append((shoot_agent.agent, "hotbar.1 0", 0))
+      shoot_agent.commands.schedule("chat /kill @e[type=!player]", 0)
+      shoot_agent.commands.schedule("hotbar.1 1", 0)
+      shoot_agent.commands.schedule("hotbar.1 0", 0)
@@ -12,10 +12,10 @@ class XStrafingTargetMission(Mission):
 
    
     def chat_command_init(self,shoot_agent, move_agent, params):
-        shoot_agent.commands.append((shoot_agent.agent, "chat /kill @e[type=!player]", 0))
-        shoot_agent.commands.append((shoot_agent.agent, "hotbar.1 1", 0))
-        shoot_agent.commands.append((shoot_agent.agent, "hotbar.1 0", 0))
-        move_agent.commands.append((move_agent.agent, "strafe " + str(self.direction*self.speed), 0))
+        shoot_agent.commands.schedule("chat /kill @e[type=!player]", 0)
+        shoot_agent.commands.schedule("hotbar.1 1", 0)
+        shoot_agent.commands.schedule("hotbar.1 0", 0)
+        move_agent.commands.schedule("strafe " + str(self.direction*self.speed), 0)
 
 
 
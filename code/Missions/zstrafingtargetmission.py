@@ -15,9 +15,9 @@ class ZStrafingTargetMission(Mission):
    
     
     def chat_command_init(self,shoot_agent, move_agent, params):
-      shoot_agent.commands.append((shoot_agent, "chat /kill @e[type=!player]", 0))
-      shoot_agent.commands.append((shoot_agent, "hotbar.1 1", 0))
-      shoot_agent.commands.append((shoot_agent, "hotbar.1 0", 0))
+      shoot_agent.commands.schedule("chat /kill @e[type=!player]", 0)
+      shoot_agent.commands.schedule("hotbar.1 1", 0)
+      shoot_agent.commands.schedule("hotbar.1 0", 0)
 
 
 
@@ -0,0 +1,89 @@
+'''
+Closed form arrow flight for Minecraft, used as a prior for the aim models
+before they have enough data.  Each tick an arrow moves by its velocity, then
+its velocity is multiplied by DRAG and GRAVITY is subtracted from its y
+velocity.  After n ticks with initial velocity v:
+    horizontal = vx * S
+    vertical = vy * S - GRAVITY / (1 - DRAG) * (n - S)
+where S = (1 - DRAG^n) / (1 - DRAG).
+Distances are in blocks, velocities in blocks per second as in the
+observations, and angles in degrees with pitch positive upwards.
+'''
+import math
+
+GRAVITY = 0.05          #blocks/tick^2
+DRAG = 0.99             #velocity multiplier per tick
+ARROW_SPEED = 3.0       #blocks/tick from a fully drawn bow
+LAUNCH_HEIGHT = 1.52    #arrows spawn just below eye height
+TICKS_PER_SECOND = 20
+MAX_PITCH = 89.9
+
+def flight_ticks(distance, pitch, speed=ARROW_SPEED):
+    #Ticks until the arrow has travelled distance horizontally, or None if it never does
+    vx = speed * math.cos(math.radians(pitch))
+    remaining = 1 - distance * (1 - DRAG) / vx if vx > 0 else -1
+    if remaining <= 0:
+        return None
+    return math.log(remaining) / math.log(DRAG)
+
+def height_at(distance, pitch, speed=ARROW_SPEED):
+    #Height above the launch point when the arrow reaches distance, or None if it never does
+    ticks = flight_ticks(distance, pitch, speed)
+    if ticks is None:
+        return None
+    vy = speed * math.sin(math.radians(pitch))
+    s = (1 - DRAG**ticks) / (1 - DRAG)
+    return vy * s - GRAVITY / (1 - DRAG) * (ticks - s)
+
+def pitch_to_target(distance, elevation, speed=ARROW_SPEED, iterations=40):
+    '''
+    Lowest pitch that hits a point distance blocks away and elevation blocks above
+    the shooter's feet.  Falls back to the pitch with the most height at that
+    distance when the point is out of reach.
+    '''
+    height = elevation - LAUNCH_HEIGHT
+    if distance <= 0:
+        return MAX_PITCH if height >= 0 else -MAX_PITCH
+    #Height at the target distance rises with pitch up to a peak, so search below the peak
+    low, high = -MAX_PITCH, MAX_PITCH
+    for i in range(iterations):
+        middle = (low + high) / 2
+        below, above = height_at(distance, middle - 0.01, speed), height_at(distance, middle + 0.01, speed)
+        if above is not None and (below is None or above > below):
+            low = middle
+        else:
+            high = middle
+    peak = low
+    peak_height = height_at(distance, peak, speed)
+    if peak_height is None or peak_height < height:
+        return peak
+    low, high = -MAX_PITCH, peak
+    for i in range(iterations):
+        middle = (low + high) / 2
+        reached = height_at(distance, middle, speed)
+        if reached is not None and reached >= height:
+            high = middle
+        else:
+            low = middle
+    return high
+
+def time_of_flight(distance, elevation, speed=ARROW_SPEED):
+    #Seconds for an arrow aimed at (distance, elevation) to get there
+    ticks = flight_ticks(distance, pitch_to_target(distance, elevation, speed), speed)
+    if ticks is None:
+        ticks = flight_ticks(0.99 * speed / (1 - DRAG), 0, speed)
+    return ticks / TICKS_PER_SECOND
+
+def yaw_to_target(angle):
+    #Arrows fly straight, so turn by the relative angle to the target
+    return angle
+
+def leading_pitch(distance, elevation, y_velocity, speed=ARROW_SPEED):
+    #Extra pitch to hit where a vertically moving target will be on arrival
+    flight = time_of_flight(distance, elevation, speed)
+    return pitch_to_target(distance, elevation + y_velocity * flight, speed) - pitch_to_target(distance, elevation, speed)
+
+def leading_yaw(distance, x_velocity, z_velocity, speed=ARROW_SPEED):
+    #Extra yaw to hit where a sideways moving target will be on arrival
+    flight = time_of_flight(distance, 0, speed)
+    return math.degrees(math.atan2(x_velocity * flight, max(0.1, distance + z_velocity * flight)))
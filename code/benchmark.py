@@ -0,0 +1,266 @@
+'''
+Micro benchmarks for the aiming and recording hot paths.
+Usage:
+    python benchmark.py                  runs every benchmark
+    python benchmark.py signed_features  runs only the named benchmarks
+'''
+import sys
+import time
+import json
+import uuid
+import numpy as np
+from regression import polynomial_features, signed_quadratic_features
+
+
+def time_call(function, repeats=3):
+    #Best wall time of several calls, in seconds
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def loop_signed_quadratic_features(data, features, include_bias=False):
+    #Original per-row implementation, kept as the baseline
+    result = np.zeros(data.shape)
+    for i in range(len(data)):
+        to_add = np.zeros(data.shape[1])
+        square_indices = [int(j*features - j*(j-1)/2) for j in range(features)]
+        to_add[:features] = data[i,:features]
+        for j in range(features, data.shape[1]):
+            if j-features in square_indices:
+                ft = square_indices.index(j-features)
+                if data[i,ft] < 0:
+                    to_add[j] = -data[i,j]
+                else:
+                    to_add[j] = data[i,j]
+            else:
+                to_add[j] = data[i,j]
+        result[i,:] = to_add
+    return result
+
+def bench_signed_features():
+    print("signed_quadratic_features (leading model features)")
+    print("{:>10} {:>12} {:>12} {:>10}".format("rows", "loop (s)", "numpy (s)", "speedup"))
+    rng = np.random.default_rng(0)
+    for rows in [10000, 100000, 1000000]:
+        #distance, elevation/x velocity, y/z velocity like vert_leading and hori_leading
+        samples = np.column_stack((rng.uniform(0, 40, rows), rng.normal(0, 5, rows), rng.normal(0, 3, rows)))
+        data = polynomial_features(samples, 2)
+        assert np.array_equal(loop_signed_quadratic_features(data[:1000], 3), signed_quadratic_features(data[:1000], 3))
+        loop_time = time_call(lambda: loop_signed_quadratic_features(data, 3), repeats=1)
+        numpy_time = time_call(lambda: signed_quadratic_features(data, 3))
+        print("{:>10} {:>12.4f} {:>12.4f} {:>9.0f}x".format(rows, loop_time, numpy_time, loop_time / numpy_time))
+
+def bench_pitch_lookup():
+    from fileio import FileIO
+    from malmo_agent import MalmoAgent
+    print("get_pitch_to_target: model vs lookup table (saved dataset)")
+    data_set = FileIO.get_data_set()
+    direct = MalmoAgent("Slayer", None, 0, 0, 0.5, 0.5, data_set)
+    lookup = MalmoAgent("Slayer", None, 0, 0, 0.5, 0.5, data_set, use_pitch_lookup=True)
+    rng = np.random.default_rng(0)
+    queries = np.column_stack((rng.uniform(2, 60, 2000), rng.uniform(-10, 10, 2000))).tolist()
+    for agent in [direct, lookup]:
+        agent.get_pitch_to_target(*queries[0])
+    direct_time = time_call(lambda: [direct.get_pitch_to_target(d, e) for d, e in queries]) / len(queries)
+    lookup_time = time_call(lambda: [lookup.get_pitch_to_target(d, e) for d, e in queries]) / len(queries)
+    errors = [abs(direct.get_pitch_to_target(d, e) - lookup.get_pitch_to_target(d, e)) for d, e in queries]
+    print("model {:.1f} us, lookup {:.1f} us per query".format(direct_time * 1e6, lookup_time * 1e6))
+    print("query error: max {:.5f}, mean {:.5f} degrees".format(max(errors), sum(errors) / len(errors)))
+    for high_angle, (max_error, mean_error) in lookup.pitch_lookup_errors().items():
+        print("grid error ({} angle): max {:.5f}, mean {:.5f} degrees".format("high" if high_angle else "low", max_error, mean_error))
+
+def sample_entity(rng, name):
+    #Entity in the format of Malmo's ObservationFromNearbyEntities
+    return {"yaw": float(rng.uniform(-180, 180)), "x": float(rng.uniform(-40, 40)), "y": float(rng.uniform(4, 20)),
+            "z": float(rng.uniform(-40, 40)), "pitch": float(rng.uniform(-90, 90)), "id": str(uuid.UUID(int=int(rng.integers(2**62)))),
+            "motionX": float(rng.normal(0, 0.1)), "motionY": float(rng.normal(0, 0.1)), "motionZ": float(rng.normal(0, 0.1)),
+            "life": 20.0, "name": name}
+
+def sample_observation(rng, entities, arrows=0):
+    mobs = [sample_entity(rng, "Slayer"), sample_entity(rng, "Mover")]
+    mobs += [sample_entity(rng, "Horse") for i in range(entities)]
+    mobs += [sample_entity(rng, "Arrow") for i in range(arrows)]
+    return json.dumps({"Mobs": mobs})
+
+def bench_decode():
+    from observation import decode_observation, DECODER
+    print("Observation decode latency per frame (decoder: {})".format(DECODER))
+    print("{:>10} {:>10} {:>16} {:>16}".format("entities", "bytes", "old 2x json (us)", "decode once (us)"))
+    rng = np.random.default_rng(0)
+    for entities in [4, 50, 500]:
+        payloads = [sample_observation(rng, entities, arrows=5) for i in range(100)]
+        def old():
+            for text in payloads:
+                if json.loads(text):
+                    json.loads(text)
+        def new():
+            for text in payloads:
+                decode_observation(text)
+        print("{:>10} {:>10} {:>16.1f} {:>16.1f}".format(entities, len(payloads[0]),
+            time_call(old) / len(payloads) * 1e6, time_call(new) / len(payloads) * 1e6))
+
+def bench_entity_index():
+    from observation import decode_observation
+    from malmo_agent import find_entity_by_id, find_new_arrow, find_mob_by_name
+    print("Entity lookups per tick: linear scans vs per-frame index")
+    print("{:>8} {:>14} {:>14}".format("arrows", "scan (us)", "index (us)"))
+    rng = np.random.default_rng(0)
+    def scan_by_id(entities, id):
+        for entity in entities:
+            if entity["id"] == id:
+                return entity
+    def scan_by_name(entities, name):
+        for entity in entities:
+            if entity["name"] == name:
+                return entity
+    for arrows in [1, 5, 10, 25, 50]:
+        texts = [sample_observation(rng, 4, arrows) for i in range(50)]
+        frames = [decode_observation(text) for text in texts]
+        def ids(frame):
+            target_id = frame["Mobs"][2]["id"]
+            arrow_ids = [mob["id"] for mob in frame["Mobs"] if mob["name"] == "Arrow"]
+            return target_id, arrow_ids
+        work = [(frame, ids(frame)) for frame in frames]
+        def scan():
+            for frame, (target_id, arrow_ids) in work:
+                mobs = frame["Mobs"]
+                scan_by_name(mobs, "Slayer")
+                scan_by_name(mobs, "Mover")
+                scan_by_id(mobs, target_id)
+                #ArrowTracker.step and track_arrow for every arrow in flight
+                for arrow_id in arrow_ids:
+                    scan_by_id(mobs, target_id)
+                    scan_by_id(mobs, arrow_id)
+                scan_by_id(mobs, "new arrow")
+        def index():
+            for frame, (target_id, arrow_ids) in work:
+                #Count building the index, which happens once per frame
+                frame.__dict__.pop("_index", None)
+                find_mob_by_name(frame, "Slayer")
+                find_mob_by_name(frame, "Mover")
+                find_entity_by_id(frame, target_id)
+                for arrow_id in arrow_ids:
+                    find_entity_by_id(frame, target_id)
+                    find_entity_by_id(frame, arrow_id)
+                find_new_arrow(frame, set(arrow_ids))
+        print("{:>8} {:>14.1f} {:>14.1f}".format(arrows, time_call(scan) / len(work) * 1e6, time_call(index) / len(work) * 1e6))
+
+def bench_velocity():
+    from transform import Transform
+    from estimator import KalmanEstimator
+    print("Target velocity: finite difference vs Kalman filter (strafing target, jittered timestamps)")
+    print("{:>12} {:>14} {:>14} {:>16}".format("jitter (s)", "fd rms (b/s)", "kf rms (b/s)", "kf update (us)"))
+    rng = np.random.default_rng(0)
+    ticks = 2000
+    times = np.arange(ticks) * 0.05
+    #Strafe back and forth like the moving target missions
+    phase = 2 * np.pi * times / 3.0
+    positions = np.column_stack((6 * np.sin(phase), 2 * np.sin(phase / 2), 20 + 0 * times))
+    velocities = np.column_stack((6 * np.cos(phase), np.cos(phase / 2), 0 * times)) * 2 * np.pi / 3.0
+    entities = [{"x": x, "y": y, "z": z} for x, y, z in positions.tolist()]
+    for jitter in [0.0, 0.005, 0.01, 0.02]:
+        stamps = (times + rng.normal(0, jitter, ticks)).tolist()
+        errors = {}
+        for name, estimator in [("fd", None), ("kf", KalmanEstimator())]:
+            transform = Transform(estimator=estimator)
+            squared = []
+            for i in range(ticks):
+                transform.update(entities[i], stamps[i])
+                velocity = transform.velocity()
+                if i >= 20 and velocity is not None:
+                    squared.append(np.sum((np.asarray(velocity) - velocities[i])**2))
+            errors[name] = np.sqrt(np.mean(squared))
+        estimator = KalmanEstimator()
+        update_time = time_call(lambda: [estimator.update(positions[i], stamps[i]) for i in range(ticks)]) / ticks
+        print("{:>12} {:>14.3f} {:>14.3f} {:>16.1f}".format(jitter, errors["fd"], errors["kf"], update_time * 1e6))
+
+class FakeWorldState():
+    def __init__(self, texts, running=True):
+        self.is_mission_running = running
+        self.errors = []
+        self.number_of_observations_since_last_state = len(texts)
+        self.observations = [FakeObservation(text) for text in texts]
+
+class FakeObservation():
+    def __init__(self, text):
+        self.text = text
+
+class FakeAgentHost():
+    '''
+    Stand in for a Malmo AgentHost.  A new observation is ready every tick and
+    getWorldState takes latency() seconds, like a client over a local socket.
+    '''
+
+    def __init__(self, text, latency, tick=0.05, duration=None):
+        self.text = text
+        self.latency = latency
+        self.tick = tick
+        self.start = time.time()
+        self.duration = duration
+        self.read = 0
+
+    def getWorldState(self):
+        time.sleep(self.latency())
+        elapsed = time.time() - self.start
+        produced = int(elapsed / self.tick)
+        texts = [self.text] * (produced - self.read)
+        self.read = produced
+        return FakeWorldState(texts, self.duration is None or elapsed < self.duration)
+
+def bench_polling():
+    from malmo_agent import load_grid
+    from timekeeper import TimeKeeper
+    from poller import DuoPoller, TickStats
+    print("Tick interval of a 20 Hz loop reading two agents (fake clients, 2 in 10 reads take 30 ms)")
+    print("{:>12} {:>10} {:>12} {:>12}".format("polling", "mean (ms)", "jitter (ms)", "p99 (ms)"))
+    rng = np.random.default_rng(0)
+    text = sample_observation(rng, 4, 2)
+    latency = lambda: 0.03 if rng.random() < 0.2 else 0.002
+    ticks = 100
+    def serial(agents):
+        stats = TickStats()
+        keeper = TimeKeeper()
+        for i in range(ticks):
+            stats.tick()
+            frames = [load_grid(agent) for agent in agents]
+            keeper.advance_by(0.05)
+        return stats
+    def concurrent(agents):
+        stats = TickStats()
+        keeper = TimeKeeper()
+        poller = DuoPoller(agents)
+        for i in range(ticks):
+            stats.tick()
+            frames = poller.next_frames()
+            keeper.advance_by(0.05)
+        poller.stop()
+        return stats
+    for name, loop in [("serial", serial), ("concurrent", concurrent)]:
+        summary = loop([FakeAgentHost(text, latency), FakeAgentHost(text, latency)]).summary()
+        print("{:>12} {:>10.1f} {:>12.1f} {:>12.1f}".format(name, summary["mean"] * 1e3, summary["jitter"] * 1e3, summary["p99"] * 1e3))
+
+def bench_tick_stages():
+    #The quick run of the per-stage tick suite, see tickbench.py for baselines
+    from tickbench import run_suite, QUICK_SWEEPS
+    print("Per-stage shooter tick latency (synthetic frames)")
+    run_suite(QUICK_SWEEPS, 200, 20)
+
+BENCHMARKS = {
+    "signed_features": bench_signed_features,
+    "pitch_lookup": bench_pitch_lookup,
+    "decode": bench_decode,
+    "entity_index": bench_entity_index,
+    "velocity": bench_velocity,
+    "polling": bench_polling,
+    "tick_stages": bench_tick_stages,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print()
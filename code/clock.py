@@ -0,0 +1,66 @@
+'''
+Clocks for everything that stamps or paces ticks.  Code calls get_clock().time()
+and get_clock().sleep() instead of the time module, so a mission can run on
+simulated time.
+    RealClock     wall time, the default
+    SteppedClock  time only moves when someone sleeps, and sleeping returns at
+                  once, so a simulated mission runs as fast as the CPU allows
+    ScaledClock   wall time sped up (or slowed down) by a constant factor
+Example:
+    set_clock(SteppedClock())
+    keeper = TimeKeeper()
+    keeper.advance_by(0.05)     #returns immediately, time moves on 50 ms
+'''
+import threading
+import time
+
+class RealClock():
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+class SteppedClock():
+    '''
+    Simulated time that advances by exactly the time slept.  Meant for a single
+    thread driving the simulator; threads sleeping on it would all push time on.
+    '''
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            with self._lock:
+                self.now += seconds
+
+class ScaledClock():
+    #Time passing scale times as fast as wall time
+    def __init__(self, scale):
+        self.scale = scale
+        self.start = time.time()
+
+    def time(self):
+        return self.start + (time.time() - self.start) * self.scale
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.scale)
+
+_clock = RealClock()
+
+def get_clock():
+    return _clock
+
+def set_clock(clock):
+    #Use clock from now on, returns the previous one
+    global _clock
+    previous = _clock
+    _clock = clock
+    return previous
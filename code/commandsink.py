@@ -0,0 +1,105 @@
+from clock import get_clock
+
+#Commands that set a state, so resending the current value changes nothing
+STATEFUL_COMMANDS = {"move", "strafe", "pitch", "turn", "jump", "crouch", "use", "attack"}
+#Stateful commands that count against the rate budget.  use and attack fire the
+#bow, so they are never held back
+RATE_LIMITED_COMMANDS = {"move", "strafe", "pitch", "turn", "jump", "crouch"}
+
+class CommandSink():
+    '''
+    Stands in for a Malmo AgentHost and cuts down the commands sent to it.
+    Stateful commands (turn 0.3, use 1) are held until flush(), so only the
+    last one of each verb per tick is sent, and a value within tolerance of the
+    last one sent is dropped.  Other commands (chat, hotbar, quit) are sent
+    straight away, after anything already pending so the order is kept.
+    rate_limit caps rate limited commands per second; commands over budget stay
+    pending and the newest value goes out once there is budget again.
+    Everything else (getWorldState, startMission, ...) is passed to the host.
+    Example:
+        agent = CommandSink(agent_host, rate_limit=100)
+        agent.sendCommand("turn 0.5")
+        agent.sendCommand("turn 0.25")
+        agent.flush()   #sends "turn 0.25" only
+    '''
+
+    def __init__(self, host, tolerance=1e-3, rate_limit=None):
+        self.host = host
+        self.tolerance = tolerance
+        self.rate_limit = rate_limit
+        self.sent = 0
+        self.suppressed = 0
+        self._pending = {}
+        self._last = {}
+        self._tokens = rate_limit
+        self._refilled = get_clock().time()
+
+    def __getattr__(self, name):
+        #Only called for attributes the sink does not have itself
+        if name == "host":
+            raise AttributeError(name)
+        return getattr(self.host, name)
+
+    def sendCommand(self, command):
+        verb = command.split(" ", 1)[0]
+        if verb not in STATEFUL_COMMANDS:
+            self.flush()
+            self._send(verb, command)
+            return
+        if verb in self._pending:
+            #Replaced by a newer value in the same tick
+            self.suppressed += 1
+            del self._pending[verb]
+        self._pending[verb] = command
+
+    def flush(self):
+        #Send the pending commands, returns how many were sent
+        self._refill()
+        sent = 0
+        for verb, command in list(self._pending.items()):
+            if self._repeats(verb, command):
+                self.suppressed += 1
+            elif self._tokens is not None and verb in RATE_LIMITED_COMMANDS:
+                if self._tokens < 1:
+                    continue
+                self._tokens -= 1
+                self._send(verb, command)
+                sent += 1
+            else:
+                self._send(verb, command)
+                sent += 1
+            del self._pending[verb]
+        return sent
+
+    def clear(self):
+        #Forget pending and last sent values, e.g. when a new mission starts
+        self._pending = {}
+        self._last = {}
+
+    def _send(self, verb, command):
+        self.host.sendCommand(command)
+        self.sent += 1
+        if verb in STATEFUL_COMMANDS:
+            self._last[verb] = command
+
+    def _repeats(self, verb, command):
+        #Whether command sets the same state as the last one sent
+        last = self._last.get(verb)
+        if last is None:
+            return False
+        if command == last:
+            return True
+        try:
+            value = float(command.split(" ", 1)[1])
+            last_value = float(last.split(" ", 1)[1])
+        except (IndexError, ValueError):
+            return False
+        #Always send a stop, however small the last value was
+        return value != 0 and abs(value - last_value) <= self.tolerance
+
+    def _refill(self):
+        if self.rate_limit is None:
+            return
+        now = get_clock().time()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+        self._refilled = now
@@ -1,17 +1,387 @@
+import math
+import random
+import numpy as np
+from collections import deque, Counter
 
+#Names of the sample tables stored in a DataSet
+TABLES = ("hori_shots", "hori_leading", "vert_shots", "vert_leading")
+#Number of recent row changes remembered per table for incremental models
+JOURNAL_LENGTH = 4096
+#Default bin widths for each feature column when a DataSet is capacity bounded
+BIN_SIZES = {
+    "hori_shots": (5.0,),                #delta angle
+    "hori_leading": (2.0, 0.5, 0.5),     #distance, x velocity, z velocity
+    "vert_shots": (2.0, 1.0),            #distance, elevation
+    "vert_leading": (2.0, 1.0, 0.5),     #distance, elevation, y velocity
+}
+
+class Table():
+    '''
+    A table of float samples stored in one preallocated array that doubles in
+    size when full.  Supports the list operations callers use on tables
+    (append, pop, len, indexing, iteration), and np.asarray(table) returns a
+    view of the filled rows without copying.
+    '''
+
+    def __init__(self, rows=None, capacity=64):
+        self._data = None
+        self._size = 0
+        self._capacity = max(1, capacity)
+        if rows is not None and len(rows) > 0:
+            self.extend(rows)
+
+    def __getstate__(self):
+        return {"data": self.array.copy()}
+
+    def __setstate__(self, state):
+        self.__init__(state["data"])
+
+    @property
+    def array(self):
+        #View of the filled rows.  Only valid until the table next grows
+        if self._data is None:
+            return np.empty((0, 0))
+        return self._data[:self._size]
+
+    @property
+    def width(self):
+        return 0 if self._data is None else self._data.shape[1]
+
+    def _reserve(self, size, width):
+        if self._data is None:
+            capacity = self._capacity
+            while capacity < size:
+                capacity *= 2
+            self._data = np.empty((capacity, width))
+        elif size > self._data.shape[0]:
+            capacity = self._data.shape[0]
+            while capacity < size:
+                capacity *= 2
+            data = np.empty((capacity, self._data.shape[1]))
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+    def append(self, row):
+        row = np.asarray(row, dtype=float)
+        self._reserve(self._size + 1, row.shape[0])
+        self._data[self._size] = row
+        self._size += 1
+
+    def extend(self, rows):
+        rows = np.atleast_2d(np.asarray(rows, dtype=float))
+        if rows.shape[0] == 0:
+            return
+        self._reserve(self._size + rows.shape[0], rows.shape[1])
+        self._data[self._size:self._size + rows.shape[0]] = rows
+        self._size += rows.shape[0]
+
+    def pop(self, index=-1):
+        if self._size == 0:
+            raise IndexError("pop from empty table")
+        index = range(self._size)[index]
+        row = self._data[index].copy()
+        #Popping the last row is O(1).  Other rows shift down like a list
+        self._data[index:self._size - 1] = self._data[index + 1:self._size]
+        self._size -= 1
+        return row
+
+    def clear(self):
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        return self.array[index]
+
+    def __setitem__(self, index, row):
+        self.array[index] = row
+
+    def __iter__(self):
+        return iter(self.array)
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.array, dtype=dtype)
+        return np.asarray(self.array, dtype=dtype)
+
+    def __repr__(self):
+        return "Table({} rows)".format(self._size)
+
+class BinnedReservoir():
+    '''
+    Keeps a Table at or under capacity rows while covering the feature space.
+    Rows are binned by their feature columns (all but the last).  Once the table
+    is full, a new row replaces a random row of the densest bin if its own bin
+    is smaller, otherwise it is reservoir sampled into its own bin.  Dense
+    regions are thinned out first and rare regions are kept.
+    pop() undoes the most recent add, as record_shot expects of popping a list.
+    '''
+
+    def __init__(self, table, capacity, bin_size, seed=None):
+        self.table = table
+        self.capacity = capacity
+        self.bin_size = bin_size
+        self.random = random.Random(seed)
+        self.bins = {}
+        self.seen = {}
+        self.slot_keys = []
+        self.slot_positions = []
+        self.undo = deque(maxlen=JOURNAL_LENGTH)
+        #Re-add existing rows so a table over capacity is sampled down
+        rows = table.array.copy()
+        table.clear()
+        for row in rows:
+            self.add(row)
+        self.undo.clear()
+
+    def key(self, row):
+        return tuple(math.floor(value / size) for value, size in zip(row[:-1].tolist(), self.bin_size))
+
+    def _add_slot(self, slot, key):
+        members = self.bins.setdefault(key, [])
+        if slot == len(self.slot_keys):
+            self.slot_keys.append(key)
+            self.slot_positions.append(len(members))
+        else:
+            self.slot_keys[slot] = key
+            self.slot_positions[slot] = len(members)
+        members.append(slot)
+
+    def _remove_slot(self, slot):
+        #Swap remove the slot from its bin
+        key = self.slot_keys[slot]
+        members = self.bins[key]
+        last = members.pop()
+        if last != slot:
+            members[self.slot_positions[slot]] = last
+            self.slot_positions[last] = self.slot_positions[slot]
+        if len(members) == 0:
+            del self.bins[key]
+
+    def _replace(self, slot, row, key):
+        old_row = self.table[slot].copy()
+        old_key = self.slot_keys[slot]
+        self._remove_slot(slot)
+        self.table[slot] = row
+        self._add_slot(slot, key)
+        self.undo.append((key, slot, old_row, old_key))
+        return [(-1, old_row), (1, row)]
+
+    def add(self, row):
+        '''
+        Adds a row and returns the changes made to the table as (+1 or -1, row).
+        '''
+        key = self.key(row)
+        self.seen[key] = self.seen.get(key, 0) + 1
+        if len(self.table) < self.capacity:
+            self.table.append(row)
+            self._add_slot(len(self.table) - 1, key)
+            self.undo.append((key, None, None, None))
+            return [(1, row)]
+        count = len(self.bins.get(key, []))
+        densest = max(self.bins, key=lambda k: len(self.bins[k]))
+        if count < len(self.bins[densest]):
+            return self._replace(self.random.choice(self.bins[densest]), row, key)
+        #Reservoir sample within the row's own bin
+        if self.random.randrange(self.seen[key]) < count:
+            return self._replace(self.random.choice(self.bins[key]), row, key)
+        self.undo.append((key, -1, None, None))
+        return []
+
+    def pop(self):
+        '''
+        Undoes the most recent add.  Returns (row, changes made to the table as (+1 or -1, row)).
+        '''
+        if len(self.undo) == 0:
+            #Nothing left to undo, so remove the last row like a list
+            row = self._pop_last()
+            return row, [(-1, row)]
+        key, slot, old_row, old_key = self.undo.pop()
+        self.seen[key] -= 1
+        if slot is None:
+            row = self._pop_last()
+            return row, [(-1, row)]
+        if slot == -1:
+            #The row was never stored
+            return None, []
+        row = self.table[slot].copy()
+        self._remove_slot(slot)
+        self.table[slot] = old_row
+        self._add_slot(slot, old_key)
+        return row, [(-1, row), (1, old_row)]
+
+    def _pop_last(self):
+        slot = len(self.table) - 1
+        self._remove_slot(slot)
+        self.slot_keys.pop()
+        self.slot_positions.pop()
+        return self.table.pop(-1)
 
 class DataSet():
 
-    def __init__(self, horizontal_shots=[], vertical_shots=[], hori_leading=[], vert_leading=[]):
-        self.hori_shots = horizontal_shots
-        self.hori_leading = hori_leading
-        self.vert_shots = vertical_shots
-        self.vert_leading= vert_leading
+    def __init__(self, horizontal_shots=[], vertical_shots=[], hori_leading=[], vert_leading=[], capacity=None, bin_sizes=None):
+        self.hori_shots = Table(horizontal_shots)
+        self.hori_leading = Table(hori_leading)
+        self.vert_shots = Table(vertical_shots)
+        self.vert_leading = Table(vert_leading)
+        #Counts every row appended or removed from each table.  Used to tell
+        #when models fit on a table are out of date
+        self.versions = dict.fromkeys(TABLES, 0)
+        self.reset_journals()
+        #Every change since log_changes(), or None when not logging
+        self.change_log = None
+        self.set_capacity(capacity, bin_sizes)
 
-    def empty(self):
-        return self.hori_shots == [] or self.vert_shots == []
+    def __getstate__(self):
+        #Journals and reservoirs only matter in this process, so are not saved
+        state = self.__dict__.copy()
+        del state["journals"]
+        del state["reservoirs"]
+        state.pop("change_log", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        #Data sets pickled before tables were columnar hold lists of rows
+        for table in TABLES:
+            if not isinstance(getattr(self, table), Table):
+                setattr(self, table, Table(getattr(self, table)))
+        #Data sets pickled before versions existed start at version 0
+        if "versions" not in state:
+            self.versions = dict.fromkeys(TABLES, 0)
+        self.reset_journals()
+        self.change_log = None
+        self.set_capacity(state.get("capacity"), state.get("bin_sizes"))
+
+    def reset_journals(self):
+        #Journal entries are (version after change, +1 or -1, array of rows)
+        self.journals = {table: deque(maxlen=JOURNAL_LENGTH) for table in TABLES}
+
+    def set_capacity(self, capacity, bin_sizes=None):
+        '''
+        Bound every table to capacity rows, or remove the bound with None.
+        Tables already over capacity are sampled down.  bin_sizes overrides
+        BIN_SIZES for some or all tables.
+        '''
+        self.capacity = capacity
+        self.bin_sizes = dict(BIN_SIZES, **(bin_sizes or {}))
+        self.reservoirs = {}
+        if capacity is None:
+            return
+        for table in TABLES:
+            before = len(getattr(self, table))
+            self.reservoirs[table] = BinnedReservoir(getattr(self, table), capacity, self.bin_sizes[table])
+            if before > len(getattr(self, table)):
+                #Rows were dropped, so models must rebuild from the table
+                self.versions[table] += 1
+                self.journals[table].clear()
 
+    def _record(self, table, sign, rows):
+        self.versions[table] += rows.shape[0]
+        self.journals[table].append((self.versions[table], sign, rows))
+        if self.change_log is not None:
+            self.change_log[table].append((sign, rows))
 
+    def append(self, table, row):
+        #Append a row to a table and bump its version
+        self.extend(table, [row])
+
+    def extend(self, table, rows):
+        #Append several rows to a table at once
+        rows = np.atleast_2d(np.asarray(rows, dtype=float))
+        if rows.shape[0] == 0:
+            return
+        if table in self.reservoirs:
+            for row in rows:
+                for sign, changed in self.reservoirs[table].add(row):
+                    self._record(table, sign, changed.reshape(1, -1))
+            return
+        getattr(self, table).extend(rows)
+        self._record(table, 1, rows)
+
+    def pop(self, table):
+        #Remove the last row of a table and bump its version.
+        #A bounded table undoes its last append instead
+        if table in self.reservoirs:
+            row, changes = self.reservoirs[table].pop()
+            for sign, changed in changes:
+                self._record(table, sign, changed.reshape(1, -1))
+            return row
+        row = getattr(self, table).pop(-1)
+        self._record(table, -1, row.reshape(1, -1))
+        return row
+
+    def version(self, table):
+        return self.versions[table]
+
+    def changes_since(self, table, version):
+        '''
+        Returns a list of (+1 or -1, array of rows) changes made to a table after
+        version, or None if the journal no longer reaches back that far.
+        '''
+        if version == self.versions[table]:
+            return []
+        journal = self.journals[table]
+        if version is None or version > self.versions[table] or len(journal) == 0:
+            return None
+        changes = []
+        for (changed, sign, rows) in journal:
+            if changed - rows.shape[0] >= version:
+                changes.append((sign, rows))
+            elif changed > version:
+                #version falls inside a batch, so the journal cannot be replayed
+                return None
+        if journal[0][0] - journal[0][2].shape[0] > version:
+            return None
+        return changes
+
+    def log_changes(self):
+        #Keep every change from now on, for take_changes().  Unlike the journal the log is not bounded
+        self.change_log = {table: [] for table in TABLES}
+
+    def take_changes(self):
+        '''
+        Net rows added to and removed from each table since log_changes() or
+        the last take_changes(), as {table: (added rows, removed rows)}.  A row
+        added and removed again in that time is in neither.
+        '''
+        result = {}
+        for table in TABLES:
+            log = self.change_log[table]
+            net = Counter()
+            for sign, rows in log:
+                for row in rows:
+                    net[tuple(row)] += sign
+            added = []
+            for sign, rows in log:
+                if sign > 0:
+                    for row in rows:
+                        if net[tuple(row)] > 0:
+                            net[tuple(row)] -= 1
+                            added.append(row)
+            removed = [row for row, count in net.items() if count < 0 for i in range(-count)]
+            result[table] = (np.asarray(added, dtype=float), np.asarray(removed, dtype=float))
+        self.change_log = {table: [] for table in TABLES}
+        return result
+
+    def merge(self, table, added, removed):
+        '''
+        Take in another data set's changes from take_changes(): removed rows
+        are removed by value, then the added rows are appended.  A bounded
+        table only takes the added rows, since it drops rows by its own
+        sampling rather than the other set's.
+        '''
+        rows = getattr(self, table)
+        if table not in self.reservoirs:
+            for row in removed:
+                matches = np.flatnonzero(np.all(rows.array == row, axis=1)) if len(rows) > 0 else []
+                if len(matches) > 0:
+                    self._record(table, -1, rows.pop(matches[-1]).reshape(1, -1))
+        self.extend(table, added)
+
+    def empty(self):
+        return len(self.hori_shots) == 0 or len(self.vert_shots) == 0
 
     def clear_horizontal_static_shots(self):
         #Hori_shots append (horz_angle_between shooter and target, distance to target, target's tangential velocity, aiming_yaw)
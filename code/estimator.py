@@ -0,0 +1,70 @@
+import numpy as np
+
+class KalmanEstimator():
+    '''
+    Constant acceleration Kalman filter for an entity's position.
+    Each axis has the state (position, velocity, acceleration).  The axes share
+    the same motion and noise model, so they share one 3x3 covariance and every
+    update is O(1).  Velocities are in blocks per second like Transform motion.
+    jerk_noise is the spectral density of the random jerk driving the motion,
+    position_noise the variance of an observed position.
+    Example:
+        estimator = KalmanEstimator()
+        estimator.update((x, y, z), obs["time"])
+        vx, vy, vz = estimator.velocity
+    '''
+
+    def __init__(self, jerk_noise=50.0, position_noise=0.003, initial_velocity_variance=25.0, initial_acceleration_variance=100.0):
+        self.jerk_noise = jerk_noise
+        self.position_noise = position_noise
+        self.initial_variance = (position_noise, initial_velocity_variance, initial_acceleration_variance)
+        self.reset()
+
+    def reset(self):
+        self.state = None
+        self.covariance = None
+        self.time = None
+        self.updates = 0
+
+    def update(self, position, time):
+        measured = np.asarray(position, dtype=float)
+        if self.state is None:
+            #rows are position, velocity, acceleration; columns are x, y, z
+            self.state = np.zeros((3, 3))
+            self.state[0] = measured
+            self.covariance = np.diag(self.initial_variance)
+            self.time = time
+            self.updates = 1
+            return self
+        dt = time - self.time
+        if dt > 0:
+            self.predict(dt)
+            self.time = time
+        #Measure position only
+        innovation = measured - self.state[0]
+        gain = self.covariance[:,0] / (self.covariance[0,0] + self.position_noise)
+        self.state += np.outer(gain, innovation)
+        self.covariance -= np.outer(gain, self.covariance[0])
+        self.updates += 1
+        return self
+
+    def predict(self, dt):
+        transition = np.array([[1, dt, dt*dt/2], [0, 1, dt], [0, 0, 1]])
+        noise = self.jerk_noise * np.array([
+            [dt**5/20, dt**4/8, dt**3/6],
+            [dt**4/8, dt**3/3, dt**2/2],
+            [dt**3/6, dt**2/2, dt]])
+        self.state = transition @ self.state
+        self.covariance = transition @ self.covariance @ transition.T + noise
+
+    @property
+    def position(self):
+        return None if self.state is None else tuple(self.state[0])
+
+    @property
+    def velocity(self):
+        return None if self.state is None else tuple(self.state[1])
+
+    @property
+    def acceleration(self):
+        return None if self.state is None else tuple(self.state[2])
@@ -3,6 +3,7 @@ from matplotlib import pyplot as plt
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import PolynomialFeatures
 from matplotlib.ticker import MaxNLocator
+from regression import signed_quadratic_features
 
 def MaxMinExtend(data, extension=0.5):
     # Return the min and max of data, but stretched by extension*range
@@ -11,24 +12,6 @@ def MaxMinExtend(data, extension=0.5):
     rRange = rMax - rMin
     return (rMin - rRange * extension, rMax + rRange * extension)
 
-def signed_quadratic_features(data, features, include_bias=False):
-    result = np.zeros(data.shape)
-    for i in range(len(data)):
-        to_add = np.zeros(data.shape[1])
-        square_indices = [int(j*features - j*(j-1)/2) for j in range(features)]
-        to_add[:features] = data[i,:features]
-        for j in range(features, data.shape[1]):
-            if j-features in square_indices:
-                ft = square_indices.index(j-features)
-                if data[i,ft] < 0:
-                    to_add[j] = -data[i,j]
-                else:
-                    to_add[j] = data[i,j]
-            else:
-                to_add[j] = data[i,j]
-        result[i,:] = to_add
-    return result
-
 class Graphing:
     array = None
     errors = None
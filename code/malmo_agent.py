@@ -1,8 +1,12 @@
 try:
     from malmo import MalmoPython
+    import malmo.minecraftbootstrap
 except:
-    import MalmoPython
-import malmo.minecraftbootstrap
+    try:
+        import MalmoPython
+    except ImportError:
+        #Without Malmo only the simulator backend is available
+        MalmoPython = None
 
 import os
 import sys
@@ -12,9 +16,16 @@ import random
 import math
 import numpy as np
 from matplotlib import pyplot as plt
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
+import ballistics
 from timekeeper import TimeKeeper
+from clock import get_clock
+from observation import read_frame, entity_index
+from transform import Transform
+from estimator import KalmanEstimator
+from trainer import BackgroundTrainer
+from scheduler import CommandScheduler
+from commandsink import CommandSink
+from regression import ModelCache, TableModel, PitchLookupTable, polynomial_features, signed_quadratic_features
 
 
 def logistic(x):
@@ -49,28 +60,24 @@ def load_grid(agent):
         if len(world_state.errors) > 0:
             raise AssertionError('Could not load grid.')
 
-        if world_state.number_of_observations_since_last_state > 0 and \
-           json.loads(world_state.observations[-1].text):
-            result = json.loads(world_state.observations[-1].text)
-            result["time"] = time.time()
+        result = read_frame(world_state)
+        if result:
+            result["time"] = get_clock().time()
             return result
 
         keeper.advance_by(0.05)
         wait_time += 0.05
 
 def find_mob_by_name(mobs, name, new=False):
-    for m in mobs:
-        if m["name"] == name:
-            return m
-    return None
+    #mobs can be a Frame, an EntityIndex or a list of entities
+    return entity_index(mobs).first_named([name])
+
 def find_entity_by_id(entities, id):
-    for entity in entities:
-        if entity["id"] == id:
-            return entity
+    return entity_index(entities).by_id.get(id)
 
 def find_new_arrow(entities, arrow_set):
-    for entity in entities:
-        if entity["name"] == "Arrow" and entity["id"] not in arrow_set:
+    for entity in entity_index(entities).named("Arrow"):
+        if entity["id"] not in arrow_set:
             return entity
 
 def magnitude(vector):
@@ -102,66 +109,82 @@ def project_vector(vector1, vector2):
     magsq = np.sum(vector2**2)
     return prod/magsq * vector2
 
-def signed_quadratic_features(data, features, include_bias=False):
-    result = np.zeros(data.shape)
-    for i in range(len(data)):
-        to_add = np.zeros(data.shape[1])
-        square_indices = [int(j*features - j*(j-1)/2) for j in range(features)]
-        to_add[:features] = data[i,:features]
-        for j in range(features, data.shape[1]):
-            if j-features in square_indices:
-                ft = square_indices.index(j-features)
-                if data[i,ft] < 0:
-                    to_add[j] = -data[i,j]
-                else:
-                    to_add[j] = data[i,j]
-            else:
-                to_add[j] = data[i,j]
-        result[i,:] = to_add
-    return result
+def leading_features(data):
+    #Features used by both leading models
+    return signed_quadratic_features(polynomial_features(data, 2), 3)
 
 def get_closest_point(curve, target):
     '''
-    Get closest points based on two lists of locations at times.
-    Curve is a list of points that define a trajectory.
-    Target is a list of points that define the target location.
-    Returns the 2 closest points on the list of segments at a given time.
+    Closest approach of two trajectories given as arrays of (x, y, z, time)
+    samples taken at the same times.  Between samples both are taken to move in
+    a straight line, so the approach is found on every segment pair at once.
+    Returns (curve point, target point, distance, time) at the closest approach,
+    or None without samples.
     ''' 
 
     if len(curve) == 0 or len(target) == 0:
         return None
 
-    point1, point2 = curve[0][0], target[0][0]
-    min_distance = magnitude(point1 - point2)
-    for i in range(1, len(curve)):
-        dist = magnitude(curve[i][0] - target[i][0])
-        if dist < min_distance:
-            point1, point2 = curve[i][0], target[i][0]
-            min_distance = dist
+    offsets = curve[:,:3] - target[:,:3]
+    if len(offsets) == 1:
+        return curve[0,:3], target[0,:3], np.sqrt(np.sum(offsets[0]**2)), curve[0,3]
+    #Offset on segment k is offsets[k] + s * change[k] for s in [0, 1]
+    change = offsets[1:] - offsets[:-1]
+    change_sq = np.sum(change**2, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = np.where(change_sq > 0, -np.sum(offsets[:-1] * change, axis=1) / change_sq, 0)
+    s = np.clip(s, 0, 1)
+    distances = np.sqrt(np.sum((offsets[:-1] + s[:,None] * change)**2, axis=1))
+    k = np.argmin(distances)
+    curve_point = curve[k,:3] + s[k] * (curve[k+1,:3] - curve[k,:3])
+    target_point = target[k,:3] + s[k] * (target[k+1,:3] - target[k,:3])
+    return curve_point, target_point, distances[k], curve[k,3] + s[k] * (curve[k+1,3] - curve[k,3])
 
-    return point1, point2
 def angle_clamp(angle):
     return ((angle + 180) % 360) - 180
 AIMING = 0
 SHOOT = 1
+#Rows a table needs before its model is used for aiming
+MODEL_MIN_ROWS = {"vert_shots": 100, "vert_leading": 100, "hori_shots": 1000, "hori_leading": 100}
 STATIC = 0
 MOVING = 1
 class ArrowTracker():
+    '''
+    Follows one arrow for up to track_duration ticks, then hands its trajectory to
+    analyze_arrow_trajectory.  With settle_ticks set it finishes as soon as the
+    outcome is decided: the arrow has not moved (stuck or gone) for settle_ticks
+    ticks, or it bounced off the target.  With stop_receding it also finishes once
+    the arrow has passed the target and moved away from it for settle_ticks
+    samples, which drops the rest of the flight from the training data.
+    '''
 
-    def __init__(self, malmo_agent, arrow_id, target_id, stored_data, aim_data):
+    def __init__(self, malmo_agent, arrow_id, target_id, stored_data, aim_data, settle_ticks=None, stop_receding=False):
         self.malmo_agent = malmo_agent
         self.arrow_id = arrow_id
         self.target_id = target_id
         self.track_duration = 50
         self.delete_me = False
-        self.target_data = []
-        self.arrow_data = []
+        #(x, y, z, time) rows, one per tick the arrow moved.  Only the first size rows are filled
+        self.arrow_samples = np.empty((self.track_duration, 4))
+        self.target_samples = np.empty((self.track_duration, 4))
+        self.size = 0
+        self.last_arrow = None
         self.stored_data = stored_data
         self.aim_data = aim_data
         self.count = 0
+        self.settle_ticks = settle_ticks
+        self.stop_receding = stop_receding
+        #Why tracking ended: timeout, stationary, bounced or receding
+        self.outcome = None
+        self.still_ticks = 0
+        #Same rule as record_shot: the arrow bounced if it came back towards the player on 4 ticks
+        self.reverse_ticks = 0
+        self.last_player_distance = 0
+        self.receding_ticks = 0
+        self.last_target_distance = None
 
     def step(self, obs):
-        target_transform = find_entity_by_id(obs["Mobs"],self.target_id)
+        target_transform = find_entity_by_id(obs,self.target_id)
         #Remove self if associated target does not exist
         if target_transform is None:
             self.delete_me = True
@@ -169,40 +192,95 @@ class ArrowTracker():
         if self.track_duration > 0:
             self.track_duration -= 1
             self.track_arrow(target_transform, obs)
+            outcome = self.settled_outcome()
+            if outcome is not None:
+                self.finish(target_transform, outcome)
         else:
-            self.delete_me = True
-            self.malmo_agent.analyze_arrow_trajectory(target_transform, self.arrow_data, self.target_data, self.stored_data, self.aim_data)
+            self.finish(target_transform, "timeout")
+
+    def finish(self, target_transform, outcome):
+        self.delete_me = True
+        self.outcome = outcome
+        self.malmo_agent.analyze_arrow_trajectory(target_transform, self.arrow_data, self.target_data, self.stored_data, self.aim_data)
+
+    def settled_outcome(self):
+        #The decided outcome of the shot, or None while the arrow is still in play
+        if self.settle_ticks is None or self.size == 0:
+            return None
+        if self.still_ticks >= self.settle_ticks:
+            return "stationary"
+        if self.reverse_ticks >= 4:
+            return "bounced"
+        if self.stop_receding and self.receding_ticks >= self.settle_ticks:
+            return "receding"
+        return None
+
+    @property
+    def arrow_data(self):
+        return self.arrow_samples[:self.size]
+
+    @property
+    def target_data(self):
+        return self.target_samples[:self.size]
 
     def track_arrow(self,target_transform, obs):
         '''
         This function is run once per tick.
-        Add the current position of the arrow to a list, if it is different from the
-        previous position.
+        Add the current position of the arrow to the sample arrays, if it is different
+        from the previous position.
         '''
-        arrow = find_entity_by_id(obs["Mobs"], self.arrow_id)
+        arrow = find_entity_by_id(obs, self.arrow_id)
         #if arrow found
         if arrow:
             #get arrow location
-            arrow_vec = np.asarray([arrow["x"], arrow["y"], arrow["z"]])
+            arrow_loc = (arrow["x"], arrow["y"], arrow["z"])
             #if first arrow data or different from previous arrow data
             #avoid appending duplicate adjacent data
-            
-            if len(self.arrow_data) == 0 or not np.array_equal(arrow_vec,self.arrow_data[-1][0]):
-                self.target_data.append((np.asarray([target_transform["x"], target_transform["y"], target_transform["z"]]), obs["time"]))
-                self.arrow_data.append((arrow_vec, obs["time"]))
+            if arrow_loc != self.last_arrow and self.size < len(self.arrow_samples):
+                self.arrow_samples[self.size] = (arrow["x"], arrow["y"], arrow["z"], obs["time"])
+                self.target_samples[self.size] = (target_transform["x"], target_transform["y"], target_transform["z"], obs["time"])
+                self.size += 1
+                self.last_arrow = arrow_loc
+                self.still_ticks = 0
+                self.update_outcome(arrow, target_transform)
+                return None
+        self.still_ticks += 1
         return None
 
+    def update_outcome(self, arrow, target_transform):
+        #Update the bounce and receding counts with the newest sample
+        player = self.malmo_agent.transform
+        player_distance = math.hypot(arrow["x"] - player["x"], arrow["z"] - player["z"])
+        if self.size > 2 and player_distance < self.last_player_distance:
+            self.reverse_ticks += 1
+        self.last_player_distance = player_distance
+        target_distance = math.sqrt((arrow["x"] - target_transform["x"])**2 + (arrow["y"] - target_transform["y"])**2 + (arrow["z"] - target_transform["z"])**2)
+        #Receding once the arrow is farther from the player than the target and getting farther from it
+        passed = player_distance > math.hypot(target_transform["x"] - player["x"], target_transform["z"] - player["z"])
+        if passed and self.last_target_distance is not None and target_distance > self.last_target_distance:
+            self.receding_ticks += 1
+        else:
+            self.receding_ticks = 0
+        self.last_target_distance = target_distance
+
   
 class MalmoAgent():
 
-    def __init__(self, name, agent, pitch, yaw, vert_step_size, hori_step_size, data_set):
+    def __init__(self, name, agent, pitch, yaw, vert_step_size, hori_step_size, data_set, refit_interval=1,
+                 use_pitch_lookup=False, lookup_bounds=((0, 64), (-32, 32)), lookup_resolution=(129, 129),
+                 background_training=False, ballistic_prior=False, prior_blend_rows=500,
+                 kalman_filter=False, min_aim_duration=20, command_tolerance=1e-3, command_rate=None,
+                 tracker_settle_ticks=5, stop_receding_arrows=False):
         self.name = name
-        self.agent = agent
+        #Commands go through a sink that drops repeats and sends once per tick on flush_commands().
+        #command_rate caps movement commands per second, None for no cap
+        self.agent = CommandSink(agent, command_tolerance, command_rate) if agent is not None else None
         self.pitch = pitch
         self.yaw = yaw
         self._obs = None
         self.transform = None
-        self.commands = []
+        #Timed commands, sent by step() when their tick comes
+        self.commands = CommandScheduler(self.agent)
         self.total_time = 0
         self.vert_step_size = vert_step_size
         self.hori_step_size = hori_step_size
@@ -211,6 +289,38 @@ class MalmoAgent():
         self.last_shot = 0
         #Data set encapsulates hori_shots and vert_shots
         self.data_set = data_set
+        #Fitted aim models are reused until refit_interval new samples are recorded
+        self.model_cache = ModelCache(refit_interval)
+        #Incremental least squares for each table.  Vertical shots are split into
+        #high angle (pitch > 45) and low angle shots
+        self.aim_models = {
+            "vert_shots": TableModel("vert_shots", lambda x: polynomial_features(x, 3), split=lambda rows: rows[:,-1] > 45),
+            "vert_leading": TableModel("vert_leading", leading_features),
+            "hori_shots": TableModel("hori_shots", lambda x: polynomial_features(x, 1)),
+            "hori_leading": TableModel("hori_leading", leading_features),
+        }
+        #Answer get_pitch_to_target from a grid rebuilt after every refit of the pitch model.
+        #lookup_bounds are ((min distance, max distance), (min elevation, max elevation))
+        self.use_pitch_lookup = use_pitch_lookup
+        self.lookup_bounds = lookup_bounds
+        self.lookup_resolution = lookup_resolution
+        #Aim with the ballistic solver until the models have data, then fade it out
+        #over prior_blend_rows more rows
+        self.ballistic_prior = ballistic_prior
+        self.prior_blend_rows = max(1, prior_blend_rows)
+        #Fit models on a worker thread and aim with the last published snapshot
+        self.trainer = None
+        if background_training:
+            lookup = (lookup_bounds, lookup_resolution) if use_pitch_lookup else None
+            self.trainer = BackgroundTrainer(self.aim_models, refit_interval, lookup)
+        #Smooth this agent's motion with a Kalman filter instead of a finite difference
+        self.kalman_filter = kalman_filter
+        #Ticks spent aiming before each shot
+        self.min_aim_duration = min_aim_duration
+        #Arrow trackers finish once their arrow is stuck, gone or bounced for this many ticks
+        #(None tracks every arrow for the full duration), optionally also once it flies away from the target
+        self.tracker_settle_ticks = tracker_settle_ticks
+        self.stop_receding_arrows = stop_receding_arrows
         self.hori_errors = []
         self.vert_errors = []
         #Decide if we need to get data for vertical shots
@@ -234,7 +344,6 @@ class MalmoAgent():
         self.total_hits = 0
 
     def reset_shoot_loop(self):
-        self.min_aim_duration = 20
         self.max_record_duration = 120 #ticks
         self.shoot_state = AIMING
         self.aim_timer = 0
@@ -277,7 +386,7 @@ class MalmoAgent():
         #Abort if no target to aim at/record data for
         if target.transform is None:
             return None
-        self.aim_data.append((angle_clamp(self.transform["yaw"]), -self.transform["pitch"], time.time()))
+        self.aim_data.append((angle_clamp(self.transform["yaw"]), -self.transform["pitch"], get_clock().time()))
         mover_obs = move_agent._obs
 
         #aims over max_aim_duration many ticks
@@ -311,11 +420,12 @@ class MalmoAgent():
         #Find newly fired arrows
         if self.listen_for_new_arrow:
             #An arrow has just been shot, so look through the observations and find it
-            arrow = find_new_arrow(mover_obs["Mobs"],self.arrow_ids)
+            arrow = find_new_arrow(mover_obs,self.arrow_ids)
             if arrow != None:
                 #add to set and stop listening for arrows
                 self.arrow_ids.add(arrow["id"])
-                self.arrow_trackers.append(ArrowTracker(self,arrow["id"], target.id, self.stored_data, self.aim_data))
+                self.arrow_trackers.append(ArrowTracker(self,arrow["id"], target.id, self.stored_data, self.aim_data,
+                                                        self.tracker_settle_ticks, self.stop_receding_arrows))
                 self.listen_for_new_arrow = False
                 self.aim_data = []
                 
@@ -325,24 +435,46 @@ class MalmoAgent():
 
 
     def calculate_desired_aim(self, target_transform):
-        distance = vert_distance(target_transform["x"], target_transform["z"], self.transform["x"], self.transform["z"])
-        elevation = target_transform["y"] - self.transform["y"]
-        obs_angle = ((get_hori_angle(self.transform["x"], self.transform["z"], target_transform["x"], target_transform["z"]) + 180) % 360) - 180
-        rel_angle = ((obs_angle - self.transform["yaw"] + 180) % 360) - 180
-        x_angle = ((obs_angle + 180 + 90) % 360) - 180
-        x_velocity = project_vector(np.asarray([target_transform["motionX"], target_transform["motionY"], target_transform["motionZ"]]), vector_from_angle(x_angle))
-        x_velocity = math.copysign(magnitude(x_velocity), math.cos(math.radians(get_angle_between(vector_from_angle(x_angle), x_velocity))))
-        y_velocity = project_vector(np.asarray([target_transform["motionX"], target_transform["motionY"], target_transform["motionZ"]]), np.asarray([0, 1, 0]))
-        y_velocity = math.copysign(magnitude(y_velocity), math.cos(math.radians(get_angle_between(np.asarray([0, 1, 0]), y_velocity))))
-        z_velocity = project_vector(np.asarray([target_transform["motionX"], target_transform["motionY"], target_transform["motionZ"]]), vector_from_angle(obs_angle))
-        z_velocity = math.copysign(magnitude(z_velocity), math.cos(math.radians(get_angle_between(vector_from_angle(obs_angle), z_velocity))))
-        #set desired pitch
-        delta_pitch = self.calculate_pitch(distance, elevation+1, y_velocity)
-        #set desired yaw
-        delta_yaw = self.calculate_yaw(rel_angle, distance, x_velocity, z_velocity)
+        features = self.aim_features([target_transform])
+        yaws, pitches = self.desired_aims_from_features(*features)
+        distance, elevation, rel_angle, x_velocity, y_velocity, z_velocity = [feature[0] for feature in features]
         #Store some data points now to use for future data points
         self.stored_data = [x_velocity, y_velocity, z_velocity, angle_clamp(self.transform["yaw"])]
-        return (((self.transform["yaw"] + delta_yaw + 180) % 360) - 180,-delta_pitch)
+        return (yaws[0], pitches[0])
+
+    def calculate_desired_aims(self, targets):
+        '''
+        Vectorized calculate_desired_aim for several targets at once.
+        targets is a sequence of target transforms, or an (n, 6) array of
+        x, y, z, motionX, motionY, motionZ.  Returns arrays of desired yaws and pitches.
+        Unlike calculate_desired_aim, does not store data for the next shot.
+        '''
+        return self.desired_aims_from_features(*self.aim_features(targets))
+
+    def aim_features(self, targets):
+        #Returns arrays of distance, elevation, relative angle and x, y, z velocity
+        #relative to the line from this agent to each target
+        if isinstance(targets, np.ndarray):
+            states = np.atleast_2d(targets).astype(float)
+        else:
+            states = np.asarray([[t["x"], t["y"], t["z"], t["motionX"], t["motionY"], t["motionZ"]] for t in targets], dtype=float).reshape(-1, 6)
+        x, y, z, motion_x, motion_y, motion_z = states.T
+        distance = np.hypot(x - self.transform["x"], z - self.transform["z"])
+        elevation = y - self.transform["y"]
+        obs_angle = angle_clamp(np.degrees(np.arctan2(self.transform["x"] - x, z - self.transform["z"])))
+        rel_angle = angle_clamp(obs_angle - self.transform["yaw"])
+        x_angle = np.radians(angle_clamp(obs_angle + 90))
+        #Signed projections onto vector_from_angle of the sideways and forward directions
+        x_velocity = -motion_x * np.sin(x_angle) + motion_z * np.cos(x_angle)
+        z_velocity = -motion_x * np.sin(np.radians(obs_angle)) + motion_z * np.cos(np.radians(obs_angle))
+        return distance, elevation, rel_angle, x_velocity, motion_y, z_velocity
+
+    def desired_aims_from_features(self, distance, elevation, rel_angle, x_velocity, y_velocity, z_velocity):
+        #set desired pitch
+        delta_pitch = self.get_pitches_to_target(distance, elevation+1) + self.get_leading_pitches(distance, elevation+1, y_velocity)
+        #set desired yaw
+        delta_yaw = self.get_yaws_to_target(rel_angle) + self.get_leading_yaws(distance, x_velocity, z_velocity)
+        return angle_clamp(self.transform["yaw"] + delta_yaw), -delta_pitch
 
     def aim_step(self, desiredYaw, desiredPitch):
         '''
@@ -434,7 +566,10 @@ class MalmoAgent():
         
         #Append errors depending on how close the arrow got
         #print(self.data_set.vert_shots[-1])
-        closest_point, target_loc = get_closest_point(data, target_data)
+        closest = get_closest_point(data, target_data)
+        if closest is None:
+            return None
+        closest_point, target_loc, distance, closest_time = closest
         vert_error = closest_point[1] - target_loc[1]
         hori_error = magnitude(closest_point[::2] - target_loc[::2])
 
@@ -445,125 +580,100 @@ class MalmoAgent():
         return -((vert_error**2 + hori_error**2)**0.5)
     
     def record_shot(self, target_transform, arrow_data, target_data, obs, aim_data):
-        #Record a shot against a static target
-        #horizontal shot = [delta horizontal angle to target, yaw]
+        '''
+        Record the samples of one shot as training rows.  arrow_data holds the
+        arrow's (x, y, z, time) rows.  Every sample where the arrow moved becomes
+        a vert_shots and hori_shots row (and leading rows while training moving
+        shots), computed for the whole trajectory at once.
+        An arrow bounced off the target if its distance from the player decreased
+        on 4 ticks.  Samples from the 4th such tick on are not recorded and the
+        last recorded row of each table is dropped.  Returns whether it bounced.
+        '''
         if len(arrow_data) < 1:
             return 0
-        #data_preds = []
-        last_distance_from_player = 0
-        current_distance_from_player = 0
-
-        #Count the number of instances where distance to arrow decreases
-        reverse_ticks = 0
         #unpack obs
         x_vel, y_vel, z_vel, player_yaw = obs
         pred_velocity = x_vel * vector_from_angle(((player_yaw + 180 + 90) % 360) - 180) + z_vel * vector_from_angle(player_yaw) + y_vel * np.asarray([0, 1, 0])
         player_loc = np.asarray([self.transform["x"], self.transform["y"], self.transform["z"]])
-
-        for i in range(len(arrow_data)):
-            #unpack arrow data
-            arrow_loc = arrow_data[i][0]
-            prev_arrow_loc = arrow_data[i-1][0]
-            timestamp = arrow_data[i][1]
-            if self.desired_pitch < 85 and (i == 0 or not np.array_equal(arrow_loc, prev_arrow_loc)):
-                past_location = arrow_loc - pred_velocity*(timestamp-aim_data[0][2])
-                ori_angle = angle_clamp(get_hori_angle(player_loc[0], player_loc[2], arrow_loc[0], arrow_loc[2]) - aim_data[0][0])
-                pred_angle = angle_clamp(get_hori_angle(player_loc[0], player_loc[2], past_location[0], past_location[2]) - aim_data[0][0])
-                ori_vert_angle = self.get_pitch_to_target(magnitude(arrow_loc[::2] - player_loc[::2]), arrow_loc[1] - player_loc[1])
-                pred_vert_angle = self.get_pitch_to_target(magnitude(past_location[::2] - player_loc[::2]), past_location[1] - player_loc[1])
-                past_angle = get_hori_angle(player_loc[0], player_loc[2], past_location[0], past_location[2])
-                past_x_vel = project_vector(pred_velocity, vector_from_angle(angle_clamp(past_angle + 90)))
-                past_x_vel = math.copysign(magnitude(past_x_vel), math.cos(math.radians(get_angle_between(vector_from_angle(angle_clamp(past_angle + 90)), past_x_vel))))
-                past_z_vel = project_vector(pred_velocity, vector_from_angle(past_angle))
-                past_z_vel = math.copysign(magnitude(past_z_vel), math.cos(math.radians(get_angle_between(vector_from_angle(past_angle), past_z_vel))))
-                d_elevation = past_location[1] - player_loc[1]
-                d_angle = angle_clamp(get_hori_angle(player_loc[0], player_loc[2], past_location[0], past_location[2]) - aim_data[0][0])
-                #data_preds.append(pred_location)
-                d_distance = magnitude(past_location[::2] - player_loc[::2])
-                #get arrow position distance from shooter.  Ignore y-difference
-                current_distance_from_player = flat_distance(arrow_loc-player_loc)
-
-                #Arrow hits if arrow's distance from player decreases.  Arrow's should strictly move away from the player's shooting position if they do not hit anyone
-                if i > 1 and current_distance_from_player < last_distance_from_player:
-                    reverse_ticks += 1
-
-                #Break if bounced off target
-                if reverse_ticks >= 4:
-                    self.data_set.vert_shots.pop(-1)
-                    self.data_set.hori_shots.pop(-1)
-                    if self.vert_train_state == MOVING:
-                        self.data_set.vert_leading.pop(-1)
-                        self.data_set.hori_leading.pop(-1)
-                    break
-                
-                #Update previous position
-                last_distance_from_player = current_distance_from_player
-
-                self.data_set.vert_shots.append([d_distance, d_elevation, aim_data[-1][1]])
-                if self.vert_train_state == MOVING:
-                    self.data_set.vert_leading.append([d_distance, d_elevation, y_vel, ori_vert_angle - pred_vert_angle])
-                
-                if aim_data[-1][1] < 80 and aim_data[-1][1] > -45:
-                    self.data_set.hori_shots.append([d_angle, angle_clamp(aim_data[-1][0] - aim_data[0][0])])
-                    if self.hori_train_state == MOVING:
-                        self.data_set.hori_leading.append([d_distance, past_x_vel, past_z_vel, angle_clamp(ori_angle - pred_angle)])
-
-                #Update previous position
-                last_distance_from_player = current_distance_from_player
+        if self.desired_pitch >= 85:
+            return False
+
+        arrows, times = arrow_data[:,:3], arrow_data[:,3]
+        #Skip samples where the arrow did not move
+        moved = np.ones(len(arrows), dtype=bool)
+        moved[1:] = np.any(arrows[1:] != arrows[:-1], axis=1)
+        indices = np.flatnonzero(moved)
+        arrows, times = arrows[indices], times[indices]
+
+        #Arrow hits if arrow's distance from player decreases.  Arrow's should strictly move away from the player's shooting position if they do not hit anyone
+        distance_from_player = np.hypot(arrows[:,0] - player_loc[0], arrows[:,2] - player_loc[2])
+        reversing = np.zeros(len(arrows), dtype=bool)
+        reversing[1:] = (distance_from_player[1:] < distance_from_player[:-1]) & (indices[1:] > 1)
+        reverse_ticks = np.cumsum(reversing)
+        bounced = reverse_ticks[-1] >= 4
+        #Samples before the 4th reverse tick are recorded
+        count = int(np.searchsorted(reverse_ticks, 4))
+        arrows, times = arrows[:count], times[:count]
+
+        #Where the arrow would be without the shooter's velocity
+        past = arrows - np.outer(times - aim_data[0][2], pred_velocity)
+        arrow_offset = arrows - player_loc
+        past_offset = past - player_loc
+        ori_angle = angle_clamp(np.degrees(np.arctan2(-arrow_offset[:,0], arrow_offset[:,2])) - aim_data[0][0])
+        past_angle = np.degrees(np.arctan2(-past_offset[:,0], past_offset[:,2]))
+        pred_angle = angle_clamp(past_angle - aim_data[0][0])
+        d_distance = np.hypot(past_offset[:,0], past_offset[:,2])
+        d_elevation = past_offset[:,1]
+        vert_angles = self.get_pitches_to_target(np.concatenate((np.hypot(arrow_offset[:,0], arrow_offset[:,2]), d_distance)),
+                                                 np.concatenate((arrow_offset[:,1], d_elevation)))
+        ori_vert_angle, pred_vert_angle = vert_angles[:count], vert_angles[count:]
+        #Shooter velocity projected on the directions across and along the line to the arrow
+        past_x_vel = -pred_velocity[0] * np.sin(np.radians(past_angle + 90)) + pred_velocity[2] * np.cos(np.radians(past_angle + 90))
+        past_z_vel = -pred_velocity[0] * np.sin(np.radians(past_angle)) + pred_velocity[2] * np.cos(np.radians(past_angle))
+
+        rows = {"vert_shots": np.column_stack((d_distance, d_elevation, np.full(count, aim_data[-1][1])))}
+        if self.vert_train_state == MOVING:
+            rows["vert_leading"] = np.column_stack((d_distance, d_elevation, np.full(count, y_vel), ori_vert_angle - pred_vert_angle))
+        if aim_data[-1][1] < 80 and aim_data[-1][1] > -45:
+            rows["hori_shots"] = np.column_stack((pred_angle, np.full(count, angle_clamp(aim_data[-1][0] - aim_data[0][0]))))
+            if self.hori_train_state == MOVING:
+                rows["hori_leading"] = np.column_stack((d_distance, past_x_vel, past_z_vel, angle_clamp(ori_angle - pred_angle)))
+
+        #Break if bounced off target
+        pops = []
+        if bounced:
+            dropped = ["vert_shots", "hori_shots"]
+            if self.vert_train_state == MOVING:
+                dropped += ["vert_leading", "hori_leading"]
+            for table in dropped:
+                if table in rows:
+                    rows[table] = rows[table][:-1]
+                else:
+                    #Nothing recorded this shot, so drop the table's last row
+                    pops.append(table)
+        for table, table_rows in rows.items():
+            self.data_set.extend(table, table_rows)
+        for table in pops:
+            self.data_set.pop(table)
         #An arrow hits the target if it has moved backward for more than 2 ticks
-        return reverse_ticks >= 4
+        return bool(bounced)
 
     def reset(self):
         #Reset the time for commands
         self.total_time = 0
-        self.comands = []
+        self.commands.clear()
+        if self.agent is not None:
+            self.agent.clear()
         self._obs = None
         
     def set_obs(self, obs):
         if not obs:
             return
         self._obs = obs
-        has_prev = self.transform is not None
-        for entity in self._obs["Mobs"]:
-            if entity["name"] == self.name:
-                if has_prev:
-                    # Append past data
-                    self.transform["prevX"].append(self.transform["x"])
-                    if len(self.transform["prevX"]) > 4:
-                        self.transform["prevX"].pop(0)
-                    self.transform["prevY"].append(self.transform["y"])
-                    if len(self.transform["prevY"]) > 4:
-                        self.transform["prevY"].pop(0)
-                    self.transform["prevZ"].append(self.transform["z"])
-                    if len(self.transform["prevZ"]) > 4:
-                        self.transform["prevZ"].pop(0)
-                    self.transform["prevTime"].append(self.transform["time"])
-                    if len(self.transform["prevTime"]) > 4:
-                        self.transform["prevTime"].pop(0)
-                    
-                else:
-                    # Create past data if none exists
-                    self.transform = {}
-                    self.transform["prevX"] = []
-                    self.transform["prevY"] = []
-                    self.transform["prevZ"] = []
-                    self.transform["prevTime"] = []
-
-                # Apply stats not found in normal transforms
-                old_transform = self.transform
-                self.transform = entity
-                self.transform["prevX"] = old_transform["prevX"]
-                self.transform["prevY"] = old_transform["prevY"]
-                self.transform["prevZ"] = old_transform["prevZ"]
-                self.transform["prevTime"] = old_transform["prevTime"]
-                self.transform["time"] = self._obs["time"]
-
-                # Calculate velocity
-                if has_prev:
-                    self.transform["motionX"] = (self.transform["x"] - self.transform["prevX"][0]) / (self.transform["time"] - self.transform["prevTime"][0])
-                    self.transform["motionY"] = (self.transform["y"] - self.transform["prevY"][0]) / (self.transform["time"] - self.transform["prevTime"][0])
-                    self.transform["motionZ"] = (self.transform["z"] - self.transform["prevZ"][0]) / (self.transform["time"] - self.transform["prevTime"][0])
-
+        for entity in entity_index(self._obs).named(self.name):
+            if self.transform is None:
+                self.transform = Transform(estimator=KalmanEstimator() if self.kalman_filter else None)
+            self.transform.update(entity, self._obs["time"])
 
     def calculate_pitch(self, distance, elevation, y_velocity):
         #Return combined delta pitch to hit a target
@@ -572,30 +682,85 @@ class MalmoAgent():
         return delta_pitch
 
     def get_pitch_to_target(self, distance, elevation):
-        #returns pitch needed to aim at target at its current position
-        array = np.asarray(self.data_set.vert_shots)
-        if array.shape[0] > 100:
-            if elevation > distance:
-                filteredArray = array[array[:,-1] > 45]
-            else:
-                filteredArray = array[array[:,-1] <= 45]
-            if filteredArray.shape[0] == 0:
-                return self.vert_angle_step
-            poly = PolynomialFeatures(3, include_bias=False).fit(filteredArray[:,:-1])
-            model = LinearRegression().fit(poly.transform(filteredArray[:,:-1]), filteredArray[:,-1])
-            return min(model.predict(poly.transform([[distance, elevation]]))[0], 89.9)
+        #returns pitch needed to aim at target at its current position.
+        #Once the prior has faded out, lookup mode answers single queries straight from the grid
+        vert_shots = len(self.data_set.vert_shots)
+        if self.use_pitch_lookup and vert_shots > MODEL_MIN_ROWS["vert_shots"] and (not self.ballistic_prior or self.prior_weight("vert_shots") >= 1):
+            high_angle = elevation > distance
+            table = self.get_pitch_lookup(high_angle) if self.get_model("vert_shots", high_angle) is not None else None
+            pitch = table.lookup(distance, elevation) if table is not None else None
+            if pitch is not None:
+                return min(pitch, 89.9)
+        return self.get_pitches_to_target([distance], [elevation])[0]
+
+    def get_pitches_to_target(self, distances, elevations):
+        #Vectorized get_pitch_to_target
+        distances = np.asarray(distances, dtype=float)
+        elevations = np.asarray(elevations, dtype=float)
+        pitches = None
+        if len(self.data_set.vert_shots) > MODEL_MIN_ROWS["vert_shots"]:
+            pitches = np.full(distances.shape, np.nan)
+            high = elevations > distances
+            for high_angle in [False, True]:
+                group = high == high_angle
+                model = self.get_model("vert_shots", high_angle) if group.any() else None
+                if model is None:
+                    continue
+                table = self.get_pitch_lookup(high_angle) if self.use_pitch_lookup else None
+                if table is not None:
+                    #Falls back to the model outside the grid
+                    pitches[group] = table.lookup_many(distances[group], elevations[group])
+                missing = group & np.isnan(pitches)
+                if missing.any():
+                    pitches[missing] = model.predict(np.column_stack((distances[missing], elevations[missing])))
+            pitches = np.minimum(pitches, 89.9)
+
+        return self.blend_prior("vert_shots", distances.shape[0], pitches,
+            lambda i: ballistics.pitch_to_target(distances[i], elevations[i]), lambda i: self.vert_angle_step)
+
+    def get_pitch_lookup(self, high_angle):
+        if self.trainer is not None:
+            return self.trainer.pitch_lookup(high_angle)
+        return self.model_cache.get(("pitch_lookup", high_angle), self.data_set.version("vert_shots"),
+            lambda: PitchLookupTable(self.get_model("vert_shots", high_angle), self.lookup_bounds[0], self.lookup_bounds[1], self.lookup_resolution))
+
+    def pitch_lookup_errors(self):
+        #Returns {high_angle: (max error, mean error)} in degrees for the current lookup grids
+        errors = {}
+        for high_angle in [False, True]:
+            table = None
+            if len(self.data_set.vert_shots) > MODEL_MIN_ROWS["vert_shots"] and self.get_model("vert_shots", high_angle) is not None:
+                table = self.get_pitch_lookup(high_angle)
+            if table is not None:
+                errors[high_angle] = (table.max_error, table.mean_error)
+        return errors
+
+    def model_age(self):
+        #Seconds since the aiming models were published, or None if not training in the background
+        if self.trainer is None:
+            return None
+        return self.trainer.model_age()
 
-        return self.vert_angle_step
+    def training_latency(self):
+        #Seconds from requesting the current models to publishing them
+        if self.trainer is None or self.trainer.snapshot is None:
+            return None
+        return self.trainer.snapshot.latency
 
     def get_leading_pitch(self, distance, elevation, y_velocity):
         #adds extra pitch to compensate for moving targets
-        array = np.asarray(self.data_set.vert_leading)
-        if array.shape[0] > 100:
-            poly = PolynomialFeatures(2, include_bias=False).fit(array[:,:-1])
-            model = LinearRegression().fit(signed_quadratic_features(poly.transform(array[:,:-1]), 3), array[:,-1])
-            return min(model.predict(signed_quadratic_features(poly.transform([[distance, elevation, y_velocity]]), 3))[0], 89.9)
-
-        return 0
+        return self.get_leading_pitches([distance], [elevation], [y_velocity])[0]
+
+    def get_leading_pitches(self, distances, elevations, y_velocities):
+        #Vectorized get_leading_pitch
+        data = np.column_stack((distances, elevations, y_velocities)).astype(float)
+        pitches = None
+        if len(self.data_set.vert_leading) > MODEL_MIN_ROWS["vert_leading"]:
+            model = self.get_model("vert_leading")
+            if model is not None:
+                pitches = np.minimum(model.predict(data), 89.9)
+
+        return self.blend_prior("vert_leading", data.shape[0], pitches, lambda i: ballistics.leading_pitch(*data[i]), lambda i: 0)
         
     def calculate_yaw(self, angle, distance, x_velocity, z_velocity):
         #self.hori_train_state = STATIC if len(self.data_set.hori_shots) < 500 else MOVING
@@ -606,27 +771,76 @@ class MalmoAgent():
 
     def get_yaw_to_target(self, angle):
         #returns yaw needed to aim at target at its current position
-        array = np.asarray(self.data_set.hori_shots)
-        if array.shape[0] > 1000:
-            poly = PolynomialFeatures(1, include_bias=False).fit(array[:,:-1])
-            model = LinearRegression().fit(poly.transform(array[:,:-1]), array[:,-1])
-            return min(max(-180, model.predict(poly.transform([[angle]]))[0]), 180)
+        return self.get_yaws_to_target([angle])[0]
+
+    def get_yaws_to_target(self, angles):
+        #Vectorized get_yaw_to_target
+        angles = np.asarray(angles, dtype=float)
+        yaws = None
+        if len(self.data_set.hori_shots) > MODEL_MIN_ROWS["hori_shots"]:
+            model = self.get_model("hori_shots")
+            if model is not None:
+                yaws = np.clip(model.predict(angles.reshape(-1, 1)), -180, 180)
         
-        return random.randrange(-180, 180)
+        return self.blend_prior("hori_shots", angles.shape[0], yaws, lambda i: ballistics.yaw_to_target(angles[i]), lambda i: random.randrange(-180, 180))
 
     def get_leading_yaw(self, distance, x_velocity, z_velocity):
         #adds extra yaw to compensate for moving targets
-        array = np.asarray(self.data_set.hori_leading)
-        if array.shape[0] > 100:
-            poly = PolynomialFeatures(2, include_bias=False).fit(array[:,:-1])
-            model = LinearRegression().fit(signed_quadratic_features(poly.transform(array[:,:-1]), 3), array[:,-1])
-            return min(max(-180, model.predict(signed_quadratic_features(poly.transform([[distance, x_velocity, z_velocity]]), 3))[0]), 180)
+        return self.get_leading_yaws([distance], [x_velocity], [z_velocity])[0]
+
+    def get_leading_yaws(self, distances, x_velocities, z_velocities):
+        #Vectorized get_leading_yaw
+        data = np.column_stack((distances, x_velocities, z_velocities)).astype(float)
+        yaws = None
+        if len(self.data_set.hori_leading) > MODEL_MIN_ROWS["hori_leading"]:
+            model = self.get_model("hori_leading")
+            if model is not None:
+                yaws = np.clip(model.predict(data), -180, 180)
         
-        return 0
+        return self.blend_prior("hori_leading", data.shape[0], yaws, lambda i: ballistics.leading_yaw(*data[i]), lambda i: 0)
+
+    def blend_prior(self, table, count, learned, prior, fallback):
+        '''
+        Combine count learned predictions (None, or NaN where there is no model yet)
+        with the ballistic prior.  The prior is used until the table has MODEL_MIN_ROWS
+        rows, then fades out over the next prior_blend_rows rows.  Without the prior,
+        fallback(i) is used where there is no learned prediction.
+        '''
+        result = np.full(count, np.nan) if learned is None else np.array(learned, dtype=float)
+        missing = np.isnan(result)
+        if not self.ballistic_prior:
+            for i in np.flatnonzero(missing):
+                result[i] = fallback(i)
+            return result
+        weight = self.prior_weight(table) if learned is not None else 0
+        needed = missing if weight >= 1 else np.ones(count, dtype=bool)
+        priors = np.full(count, np.nan)
+        for i in np.flatnonzero(needed):
+            priors[i] = prior(i)
+        result[~missing] = lerp(priors[~missing], result[~missing], weight) if weight < 1 else result[~missing]
+        result[missing] = priors[missing]
+        return result
+
+    def prior_weight(self, table):
+        #Weight of the learned model against the ballistic prior, from 0 to 1
+        return min(1, max(0, (len(getattr(self.data_set, table)) - MODEL_MIN_ROWS[table]) / self.prior_blend_rows))
+
+    def get_model(self, table, key=None):
+        #Returns the model for a table, re-solving it once enough rows have changed.
+        #May return None while the first background fit is running
+        if self.trainer is not None:
+            self.trainer.update(self.data_set)
+            return self.trainer.model(table, key)
+        return self.model_cache.get((table, key), self.data_set.version(table), lambda: self.aim_models[table].model(self.data_set, key))
 
     def process_commands(self, mission_elapsed_time):
-        for command in self.commands:
-            if command[2] <= mission_elapsed_time:
-                self.commands.remove(command)
-                command[0].sendCommand(command[1])
+        self.commands.dispatch(mission_elapsed_time)
+
+    def flush_commands(self):
+        #Send this tick's commands, call once at the end of every tick
+        return self.agent.flush()
+
+    def command_counts(self):
+        #(sent, suppressed) commands since the agent was created
+        return self.agent.sent, self.agent.suppressed
 
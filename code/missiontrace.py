@@ -0,0 +1,267 @@
+'''
+Mission traces, to replay a mission after the fact.  A TraceWriter streams the
+frames each tick consumed and every command sent to the clients to an append
+only file with one JSON object per line:
+    {"session": 1700000000.0, "dataset": {...}}           a run starts
+    {"mission": 0, "params": [...], "random": [...]}      a mission starts
+    {"tick": 0, "time": 12.5, "frames": [{...}, {...}]}   frames of one tick
+    {"agent": "Slayer", "tick": 0, "command": "turn 0.5"} a command was sent
+Commands sent between missions, like the quit that ends the last one, are
+stamped with tick null and are not compared on replay.
+A path ending in .gz is gzip compressed.  TraceReplay reads a trace back as
+the frames of each mission, so the tick loop, shooter_step and ArrowTracker
+run on them at full CPU speed, and reports where the commands they send differ
+from the recorded ones.  Replaying the same trace twice sends the same
+commands, so the digest of a replay tells whether a change to the aim or
+recording code changed what the agents do.
+Example:
+    writer = TraceWriter("missions.trace.gz", data_set)
+    agent = MalmoAgent("Slayer", RecordingHost(agent_host, writer, "Slayer"), ...)
+'''
+import gzip
+import hashlib
+import json
+import os.path
+import pickle
+import random
+import time
+from observation import decode_json, Frame
+
+#Use a faster JSON encoder when one is installed
+try:
+    import orjson
+    encode_json = orjson.dumps
+except ImportError:
+    def encode_json(value):
+        return json.dumps(value, separators=(",", ":")).encode()
+
+def open_trace(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+def snapshot_path(path):
+    #Where the data set a trace started from is saved
+    return path + ".dataset"
+
+def read_events(path):
+    #Every event of a trace in order.  Appended gzip members are read as one stream
+    with open_trace(path, "rb") as file:
+        for line in file:
+            if line.strip():
+                yield decode_json(line)
+
+class TraceWriter():
+    '''
+    Appends the events of a run to a trace.  When a data set is given and the
+    trace is new, the data set is saved next to it so a replay can start from
+    the same models.
+    '''
+
+    def __init__(self, path, data_set=None):
+        self.path = path
+        self.tick_count = None
+        if data_set is not None and not os.path.exists(snapshot_path(path)):
+            with open(snapshot_path(path), "wb") as file:
+                pickle.dump(data_set, file)
+        self.file = open_trace(path, "ab")
+        versions = dict(data_set.versions) if data_set is not None else None
+        self._write({"session": time.time(), "dataset": versions})
+
+    def mission(self, index, params):
+        #Marks the start of a mission.  Call it where the replay should take over, the
+        #random state is saved so the mission and agents draw the same numbers again
+        self.tick_count = -1
+        state = random.getstate()
+        self._write({"mission": index, "params": list(params), "random": [state[0], list(state[1]), state[2]]})
+
+    def tick(self, frames, tick_time):
+        self.tick_count += 1
+        self._write({"tick": self.tick_count, "time": tick_time, "frames": list(frames)})
+
+    def command(self, agent, command):
+        #Commands sent before the first tick of a mission are stamped with tick -1
+        self._write({"agent": agent, "tick": self.tick_count, "command": command})
+
+    def end_mission(self):
+        self.tick_count = None
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def _write(self, event):
+        self.file.write(encode_json(event) + b"\n")
+
+class RecordingHost():
+    '''
+    Stands in for a Malmo AgentHost and writes every command sent through it
+    to a trace.  Wrap the raw host, under the CommandSink, so only commands
+    that reach the client are recorded.  Everything else is passed to the host.
+    '''
+
+    def __init__(self, host, writer, name):
+        self.host = host
+        self.writer = writer
+        self.name = name
+
+    def __getattr__(self, name):
+        if name == "host":
+            raise AttributeError(name)
+        return getattr(self.host, name)
+
+    def sendCommand(self, command):
+        self.writer.command(self.name, command)
+        self.host.sendCommand(command)
+
+class ReplayWorldState():
+    #World state of a replayed mission, which runs until its frames run out
+    is_mission_running = True
+    has_mission_begun = True
+    errors = []
+    observations = []
+    number_of_observations_since_last_state = 0
+
+class ReplayHost():
+    '''
+    Stands in for a Malmo AgentHost during a replay.  Commands are kept for
+    comparison with the recorded ones instead of going anywhere.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.sent = []
+
+    def sendCommand(self, command):
+        self.sent.append(command)
+
+    def peekWorldState(self):
+        return ReplayWorldState()
+
+    def getWorldState(self):
+        return ReplayWorldState()
+
+class MissionReplay():
+    '''
+    One recorded mission.  next_frames() returns the frames of the next tick,
+    like DuoPoller does, and moves the clock to the time they were taken.
+    '''
+
+    def __init__(self, replay, index, params, random_state):
+        self.replay = replay
+        self.index = index
+        self.params = params
+        self.random_state = random_state
+        self.ticks = []
+        self.commands = {}
+        self.tick = -1
+
+    def start(self):
+        #Restore the random state the mission started with
+        version, state, gauss = self.random_state
+        random.setstate((version, tuple(state), gauss))
+
+    def next_frames(self):
+        self.replay.compare(self)
+        self.tick += 1
+        if self.tick >= len(self.ticks):
+            return None
+        tick_time, frames = self.ticks[self.tick]
+        if self.replay.clock is not None:
+            self.replay.clock.now = tick_time
+        return tuple(Frame(frame) for frame in frames)
+
+    def stop(self):
+        #Commands sent after the last tick
+        self.replay.compare(self)
+
+    def recorded(self, agent, tick):
+        return self.commands.get((agent, tick), [])
+
+class TraceReplay():
+    '''
+    Reads a trace back mission by mission.  Agents get their commands through
+    hosts from host(name), named as they were recorded, and every tick the
+    commands they sent are checked against the trace.  Set clock to a
+    SteppedClock so timestamps follow the recorded ones.
+    Example:
+        replay = TraceReplay("missions.trace.gz", clock)
+        shoot_agent = MalmoAgent("Slayer", replay.host("Slayer"), ...)
+        for mission in replay.missions():
+            mission.start()
+            frames = mission.next_frames()
+            while frames is not None:
+                ...
+                frames = mission.next_frames()
+            mission.stop()
+        print(replay.summary())
+    '''
+
+    def __init__(self, path, clock=None):
+        self.path = path
+        self.clock = clock
+        self.hosts = {}
+        self.ticks = 0
+        self.checked = 0
+        self.diverged = 0
+        self.first_divergence = None
+        self.dataset_versions = None
+        self._digest = hashlib.sha1()
+
+    def host(self, name):
+        self.hosts[name] = ReplayHost(name)
+        return self.hosts[name]
+
+    def load_data_set(self):
+        #The data set the trace started from, or None if it was not saved
+        if not os.path.exists(snapshot_path(self.path)):
+            return None
+        with open(snapshot_path(self.path), "rb") as file:
+            return pickle.load(file)
+
+    def missions(self):
+        #Missions are read one at a time, so a long trace is never all in memory
+        mission = None
+        for event in read_events(self.path):
+            if "tick" in event and "frames" in event:
+                if mission is not None:
+                    mission.ticks.append((event["time"], event["frames"]))
+            elif "command" in event:
+                if mission is not None:
+                    mission.commands.setdefault((event["agent"], event["tick"]), []).append(event["command"])
+            elif "mission" in event:
+                if mission is not None:
+                    yield mission
+                mission = MissionReplay(self, event["mission"], event["params"], event["random"])
+            elif "session" in event:
+                if self.dataset_versions is None:
+                    self.dataset_versions = event["dataset"]
+        if mission is not None:
+            yield mission
+
+    def compare(self, mission):
+        #Check the commands sent since the last call against the ones recorded for that tick
+        if mission.tick >= 0 and mission.tick < len(mission.ticks):
+            self.ticks += 1
+        for name, host in self.hosts.items():
+            expected = mission.recorded(name, mission.tick)
+            sent, host.sent = host.sent, []
+            for command in sent:
+                self._digest.update("{} {} {}\n".format(name, mission.tick, command).encode())
+            if len(expected) == 0 and len(sent) == 0:
+                continue
+            self.checked += 1
+            if sent != expected:
+                self.diverged += 1
+                if self.first_divergence is None:
+                    self.first_divergence = (mission.index, mission.tick, name, expected, sent)
+
+    def digest(self):
+        #Hash of every command sent during the replay, with its agent and tick
+        return self._digest.hexdigest()
+
+    def summary(self):
+        text = "Replayed {} ticks, {} of {} command batches differ from the trace, digest {}".format(self.ticks, self.diverged, self.checked, self.digest()[:12])
+        if self.first_divergence is not None:
+            text += "\nFirst difference: mission {}, tick {}, {} recorded {} but sent {}".format(*self.first_divergence)
+        return text
@@ -0,0 +1,105 @@
+'''
+Decoding of Malmo observations.  Each observation is parsed once into a Frame
+that every consumer of that tick shares.
+'''
+import json
+
+#Use a faster JSON decoder when one is installed
+try:
+    import orjson
+    decode_json = orjson.loads
+    DECODER = "orjson"
+except ImportError:
+    try:
+        import ujson
+        decode_json = ujson.loads
+        DECODER = "ujson"
+    except ImportError:
+        decode_json = json.loads
+        DECODER = "json"
+
+class Frame(dict):
+    '''
+    One decoded observation.  Behaves like the dict json.loads returns, so
+    frame["Mobs"] and frame["time"] keep working, and adds typed accessors.
+    '''
+
+    @property
+    def mobs(self):
+        return self.get("Mobs", [])
+
+    @property
+    def time(self):
+        return self.get("time")
+
+    @property
+    def index(self):
+        #EntityIndex of this frame's mobs, built on first use
+        try:
+            return self._index
+        except AttributeError:
+            self._index = EntityIndex(self.mobs)
+            return self._index
+
+class EntityIndex():
+    '''
+    Entities of one observation indexed by id and by name.  Malmo reports a
+    mob's type as its name (Horse, Arrow, EnderDragon), so type lookups use
+    by_name as well.  Lookups return the first matching entity in observation
+    order, like a linear scan of the list would.
+    '''
+
+    def __init__(self, entities):
+        self.entities = entities
+        #Built in reverse so the first entity with an id wins
+        self.by_id = {entity.get("id"): entity for entity in reversed(entities)}
+        self.by_name = {}
+        self._first_position = {}
+        for position, entity in enumerate(entities):
+            members = self.by_name.get(entity["name"])
+            if members is None:
+                self.by_name[entity["name"]] = [entity]
+                self._first_position[entity["name"]] = position
+            else:
+                members.append(entity)
+
+    def named(self, name):
+        #All entities with a name, in observation order
+        return self.by_name.get(name, [])
+
+    def first_named(self, names):
+        #First entity in observation order whose name is one of names
+        if len(names) == 1:
+            members = self.by_name.get(names[0])
+            return members[0] if members else None
+        present = [name for name in names if name in self.by_name]
+        if len(present) == 0:
+            return None
+        return self.by_name[min(present, key=self._first_position.get)][0]
+
+def entity_index(entities):
+    #Index of a Frame, an EntityIndex, or a plain list of entities
+    if isinstance(entities, Frame):
+        return entities.index
+    if isinstance(entities, EntityIndex):
+        return entities
+    if isinstance(entities, dict):
+        return EntityIndex(entities.get("Mobs", []))
+    return EntityIndex(entities)
+
+def decode_observation(text, timestamp=None):
+    #Parse observation text into a Frame, stamped with timestamp if given
+    frame = Frame(decode_json(text))
+    if timestamp is not None:
+        frame["time"] = timestamp
+    return frame
+
+def read_frame(world_state):
+    '''
+    Decode the newest observation of a world state.
+    Returns None if there is no new observation or it is empty.
+    '''
+    if world_state.number_of_observations_since_last_state <= 0:
+        return None
+    frame = decode_observation(world_state.observations[-1].text)
+    return frame if frame else None
@@ -0,0 +1,137 @@
+'''
+Concurrent polling of Malmo world states.  Each agent gets a thread that keeps
+reading its world state and leaves the newest decoded Frame in a latest-value
+mailbox, so the tick loop never waits on one client after another.
+'''
+import threading
+import time
+import numpy as np
+from observation import read_frame
+from clock import get_clock
+
+class WorldStatePoller():
+    '''
+    Polls one agent host on a worker thread.  Only the newest frame is kept;
+    older frames the tick loop did not take are dropped.  Each frame is stamped
+    with the time it was read and numbered, so readers can tell new from old.
+    '''
+
+    def __init__(self, agent, poll_interval=0.01):
+        self.agent = agent
+        self.poll_interval = poll_interval
+        self.frame = None
+        self.sequence = 0
+        self.running = True
+        self.error = None
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                world_state = self.agent.getWorldState()
+                if not world_state.is_mission_running:
+                    self._finish()
+                    return
+                if len(world_state.errors) > 0:
+                    raise AssertionError('Could not load grid.')
+                frame = read_frame(world_state)
+            except Exception as error:
+                self._finish(error)
+                return
+            if frame:
+                frame["time"] = get_clock().time()
+                with self._condition:
+                    self.frame = frame
+                    self.sequence += 1
+                    self._condition.notify_all()
+            time.sleep(self.poll_interval)
+
+    def _finish(self, error=None):
+        with self._condition:
+            self.running = False
+            self.error = error
+            self._condition.notify_all()
+
+    def latest(self):
+        #(frame, sequence) of the newest frame, frame is None before the first one
+        with self._condition:
+            return self.frame, self.sequence
+
+    def wait_newer(self, sequence, timeout):
+        '''
+        Block until a frame newer than sequence arrives or the mission stops.
+        Returns (frame, sequence), or (None, sequence) if no new frame came.
+        '''
+        with self._condition:
+            self._condition.wait_for(lambda: self.sequence > sequence or not self.running, timeout)
+            if self.sequence > sequence:
+                return self.frame, self.sequence
+            if self.error is not None:
+                raise self.error
+            return None, self.sequence
+
+    def stop(self):
+        self._stopped = True
+        self._thread.join()
+
+class DuoPoller():
+    '''
+    Pollers for several agents read together.  next_frames() waits until every
+    agent has a frame newer than the last one taken, so the wait is the slowest
+    client's instead of the sum of all of them, then takes the newest frames as
+    one consistent set.
+    Example:
+        poller = DuoPoller([shoot_agent.agent, move_agent.agent])
+        shooter_obs, mover_obs = poller.next_frames()
+    '''
+
+    def __init__(self, agents, poll_interval=0.01, timeout=10):
+        self.pollers = [WorldStatePoller(agent, poll_interval) for agent in agents]
+        self.timeout = timeout
+        self._taken = [0] * len(agents)
+
+    @property
+    def running(self):
+        return all(poller.running for poller in self.pollers)
+
+    def next_frames(self):
+        #Newest frame of each agent, or None if a mission ended or a frame did not arrive in time
+        deadline = time.time() + self.timeout
+        for i, poller in enumerate(self.pollers):
+            frame, sequence = poller.wait_newer(self._taken[i], max(0, deadline - time.time()))
+            if frame is None:
+                return None
+        latest = [poller.latest() for poller in self.pollers]
+        self._taken = [sequence for frame, sequence in latest]
+        return tuple(frame for frame, sequence in latest)
+
+    def stop(self):
+        for poller in self.pollers:
+            poller.stop()
+
+class TickStats():
+    '''
+    Intervals between ticks of a loop, to measure how steady its tick rate is.
+    Call tick() once per loop iteration.
+    '''
+
+    def __init__(self):
+        self.last = None
+        self.intervals = []
+
+    def tick(self):
+        now = time.time()
+        if self.last is not None:
+            self.intervals.append(now - self.last)
+        self.last = now
+
+    def summary(self):
+        #Mean interval, jitter (standard deviation) and 99th percentile in seconds
+        if len(self.intervals) == 0:
+            return None
+        intervals = np.asarray(self.intervals)
+        return {"ticks": len(intervals), "mean": float(np.mean(intervals)),
+                "jitter": float(np.std(intervals)), "p99": float(np.percentile(intervals, 99))}
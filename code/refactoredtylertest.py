@@ -1,8 +1,12 @@
 try:
     from malmo import MalmoPython
+    import malmo.minecraftbootstrap
 except:
-    import MalmoPython
-import malmo.minecraftbootstrap
+    try:
+        import MalmoPython
+    except ImportError:
+        #Without Malmo only the simulator backend is available
+        MalmoPython = None
 
 import os
 import sys
@@ -12,215 +16,126 @@ import random
 import math
 import numpy as np
 from matplotlib import pyplot as plt
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
-from Missions.staticflyingtarget import StaticFlyingTargetMission
-from Missions.xstrafingtargetmission import XStrafingTargetMission
-from Missions.simplifiedxstrafingmission import SimplifiedXStrafingMission
-from Missions.enemymission import EnemyMission
-from Missions.groundtargetmission import GroundTargetMission
-from Missions.staticstandingtarget import StaticStandingTargetMission
-from Missions.floatingtargetmission import FloatingTargetMission
-from Missions.dragonmission import DragonMission
 from malmo_agent import MalmoAgent
 from graphing import Graphing
 from fileio import FileIO
-from dataset import DataSet
-from timekeeper import TimeKeeper
+from clock import get_clock, set_clock, SteppedClock, ScaledClock
+from session import make_mission, random_params, run_mission
+from missiontrace import TraceWriter, RecordingHost, TraceReplay
+import simulator
 import pickle
 import os.path
 
-class Target():
-
-    def __init__(self):
-        self.transform = None
-        self.id = None
-
-def load_grid(agent):
-    global world_state
-    
-    wait_time = 0
-    keeper = TimeKeeper()
-    while wait_time < 10:
-        #sys.stdout.write(".")
-        
-        world_state = agent.getWorldState()
-        if not world_state.is_mission_running:
-            return None
-        if len(world_state.errors) > 0:
-            raise AssertionError('Could not load grid.')
-
-        if world_state.number_of_observations_since_last_state > 0 and \
-           json.loads(world_state.observations[-1].text):
-            result = json.loads(world_state.observations[-1].text)
-            result["time"] = time.time()
-            return result
-
-        keeper.advance_by(0.05)
-        wait_time += 0.05
-
-def find_mob_by_name(mobs, name, new=False):
-    for m in mobs:
-        if m["name"] == name:
-            return m
+def option_value(option):
+    #Value following option on the command line, or None
+    if option in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(option) + 1]
     return None
-def find_entity_by_id(entities, id):
-    if id is None:
-        return None
-    for entity in entities:
-        if entity["id"] == id:
-            return entity
-
-def sleep_until(desired_time):
-    current_time = time.time()
-    if current_time <= desired_time:
-        time.sleep(desired_time - current_time)
-
-def get_target(obs, target):
-    #Get existing target
-    new_transform = find_entity_by_id(obs["Mobs"],target.id)
-    if new_transform is None:
-        #Acquire new target
-        target.transform = my_mission.get_target(obs["Mobs"])
-        target.id = target.transform["id"] if (target.transform is not None) else None
-    else:
-        update_target_transform(target, new_transform)
-        target.id = target.transform["id"]
-    return target
-
-def update_target_transform(target, transform):
-    has_prev = "prevTime" in target.transform
-    if has_prev:
-        # Append past data
-        target.transform["prevX"].append(target.transform["x"])
-        if len(target.transform["prevX"]) > 4:
-            target.transform["prevX"].pop(0)
-        target.transform["prevY"].append(target.transform["y"])
-        if len(target.transform["prevY"]) > 4:
-            target.transform["prevY"].pop(0)
-        target.transform["prevZ"].append(target.transform["z"])
-        if len(target.transform["prevZ"]) > 4:
-            target.transform["prevZ"].pop(0)
-        target.transform["prevTime"].append(target.transform["time"])
-        if len(target.transform["prevTime"]) > 4:
-            target.transform["prevTime"].pop(0)
-        
-    else:
-        # Create past data if none exists
-        target.transform = {}
-        target.transform["prevX"] = []
-        target.transform["prevY"] = []
-        target.transform["prevZ"] = []
-        target.transform["prevTime"] = []
-
-    # Apply stats not found in normal transforms
-    old_transform = target.transform
-    target.transform = transform
-    target.transform["prevX"] = old_transform["prevX"]
-    target.transform["prevY"] = old_transform["prevY"]
-    target.transform["prevZ"] = old_transform["prevZ"]
-    target.transform["prevTime"] = old_transform["prevTime"]
-    target.transform["time"] = time.time()
-
-    # Calculate velocity
-    if has_prev:
-        target.transform["motionX"] = (target.transform["x"] - target.transform["prevX"][0]) / (target.transform["time"] - target.transform["prevTime"][0])
-        target.transform["motionY"] = (target.transform["y"] - target.transform["prevY"][0]) / (target.transform["time"] - target.transform["prevTime"][0])
-        target.transform["motionZ"] = (target.transform["z"] - target.transform["prevZ"][0]) / (target.transform["time"] - target.transform["prevTime"][0])
 
+#--simulate runs the missions in simulator.py instead of Minecraft
+simulate = "--simulate" in sys.argv
+#--record <path> appends every tick's frames and every command to a trace,
+#--replay <path> runs the agents on a recorded trace instead of a game
+record_path = option_value("--record")
+replay_path = option_value("--replay")
+args = [arg for arg in sys.argv[1:] if arg not in ("--simulate", "--record", "--replay", record_path, replay_path)]
+backend = simulator if simulate else MalmoPython
+#Clock for ticks and timestamps: None for wall time, a number to run that many times
+#faster, or "stepped" to run as fast as the CPU allows.  Only the simulator can keep up
+clock_speed = "stepped" if simulate or replay_path else None
+if clock_speed == "stepped":
+    set_clock(SteppedClock())
+elif clock_speed is not None:
+    set_clock(ScaledClock(clock_speed))
 
 # Launch the clients
-malmo.minecraftbootstrap.launch_minecraft([10001, 10002])
+if not simulate and not replay_path:
+    malmo.minecraftbootstrap.launch_minecraft([10001, 10002])
 
 # Create default Malmo objects:
 graphing = False
 
-mission_type = sys.argv[1] if len(sys.argv) > 1 else "enemymission"
-my_mission = StaticFlyingTargetMission()
-if mission_type.lower() == "enemymission":
-    my_mission = EnemyMission()
-elif mission_type.lower() == "staticflyingmission":
-    my_mission = StaticFlyingTargetMission()
-elif mission_type.lower() == "simplifiedxstrafingmission":
-    my_mission = SimplifiedXStrafingMission()
-elif mission_type.lower() == "groundtargetmission":
-    my_mission = GroundTargetMission()
-elif mission_type.lower() == "staticstandingmission":
-    my_mission = StaticStandingTargetMission()
-elif mission_type.lower() == "floatingtargetmission":
-    my_mission = FloatingTargetMission()
-elif mission_type.lower() == "dragonmission":
-    my_mission = DragonMission()
+mission_type = args[0] if len(args) > 0 else "enemymission"
+my_mission = make_mission(mission_type)
+my_mission.backend = backend
 
-agents = my_mission.two_agent_init()
+replay = TraceReplay(replay_path, get_clock()) if replay_path else None
+if replay is not None:
+    agents = (replay.host("Slayer"), replay.host("Mover"))
+else:
+    agents = my_mission.two_agent_init()
 iterations = 20
 vert_step_size = 0.5
 hori_step_size = 0.5
-
-#Load model from file
-data_set = FileIO.get_data_set()
-shoot_agent = MalmoAgent("Slayer",agents[0],0,0,vert_step_size,hori_step_size, data_set)
-move_agent = MalmoAgent("Mover",agents[1],0,0,vert_step_size,hori_step_size, data_set)
+#Number of new samples recorded before aim models are refit
+refit_interval = 1
+#Interpolate pitch from a grid of the pitch model.  The grid is rebuilt on every refit,
+#so pair this with a larger refit_interval
+use_pitch_lookup = False
+#Refit models on a worker thread so the tick loop never waits on training
+background_training = False
+#Aim with the ballistic solver while the models have little data.  Changes the aim and
+#so the recorded training rows of early shots
+use_ballistic_prior = False
+#Estimate target velocity with a Kalman filter instead of a finite difference
+use_kalman_filter = False
+#Ticks spent aiming before each shot
+min_aim_duration = 20
+#Most movement commands sent per second by each agent, or None for no limit
+command_rate = None
+#Stop tracking an arrow once it flies away from the target instead of following it to the ground
+stop_receding_arrows = False
+#Read both agents' world states on worker threads instead of one after the other.
+#The threads poll in wall time, so they only help with real clients
+concurrent_polling = not simulate and not replay_path
+
+#Maximum rows kept per DataSet table, or None to keep every sample
+dataset_capacity = None
+
+#Load model from file.  A replay starts from the data set its trace was recorded with
+data_set = replay.load_data_set() if replay is not None else None
+if data_set is None:
+    data_set = FileIO.get_data_set()
+trace = TraceWriter(record_path, data_set) if record_path else None
+if trace is not None:
+    agents = (RecordingHost(agents[0], trace, "Slayer"), RecordingHost(agents[1], trace, "Mover"))
+if dataset_capacity is not None:
+    data_set.set_capacity(dataset_capacity)
+shoot_agent = MalmoAgent("Slayer",agents[0],0,0,vert_step_size,hori_step_size, data_set, refit_interval, use_pitch_lookup,
+                         background_training=background_training, ballistic_prior=use_ballistic_prior,
+                         kalman_filter=use_kalman_filter, min_aim_duration=min_aim_duration, command_rate=command_rate,
+                         stop_receding_arrows=stop_receding_arrows)
+move_agent = MalmoAgent("Mover",agents[1],0,0,vert_step_size,hori_step_size, data_set, refit_interval,
+                        kalman_filter=use_kalman_filter, command_rate=command_rate)
 mission_accuracies = []
+recorded_missions = replay.missions() if replay is not None else None
+replay_started = time.time()
 try:
     for i in range(iterations):
-        time.sleep(1)
-        params = (random.randint(10, 30)*random.randrange(-1, 2, 2), random.randint(10, 30)*random.randrange(-1, 2, 2), random.randint(10, 30))
-        mission = MalmoPython.MissionSpec(my_mission.get_mission_xml(params), True)
-        my_mission.load_duo_mission(mission, agents)
-        shoot_agent.reset()
-        shoot_agent.reset_shoot_loop()
-        move_agent.reset()
-        
-        # Loop until mission ends:
-        record_cycle = 86
-        total_time = 0
-        keeper = TimeKeeper()
-        
-        my_mission.chat_command_init(shoot_agent,move_agent,params)
-        shoot_agent.agent.sendCommand("use 1")
-        
-        world_state = shoot_agent.agent.peekWorldState()
-        shoot_agent.reset_shoot_loop()
-        target = Target()
-        first_target_found = False
-        initial_delay = 5
-        while world_state.is_mission_running:
-            
-            shooter_obs = load_grid(shoot_agent.agent)
-            mover_obs = load_grid(move_agent.agent)
-            if not shooter_obs or not mover_obs:
-                break
-            move_agent.step(mover_obs)
-          
-            #get target
-            target = get_target(mover_obs, target)
-            if target.transform is not None:
-                first_target_found = True  
-            if target.transform is None and first_target_found:
-                #End mission early if no enemies remaining
+        if replay is not None:
+            recorded = next(recorded_missions, None)
+            if recorded is None:
                 break
+            params = recorded.params
+            recorded.start()
+        else:
+            get_clock().sleep(1)
+            params = random_params()
+            mission = backend.MissionSpec(my_mission.get_mission_xml(params), True)
+            my_mission.load_duo_mission(mission, agents)
+            if trace is not None:
+                trace.mission(i, params)
 
-            #Run shooter ticks if target exists
-            #agent step
-            if initial_delay > 0:
-                initial_delay -= 1
-            else:
-                if shoot_agent.shooter_step(shooter_obs, move_agent, target):
-                    #Change mover direction
-                    my_mission.ai_toggle(move_agent, target.transform)
-            
-            my_mission.ai_step(move_agent, target.transform)
-        
-            
-            #If shoot agent hits target, end mission early
-            if shoot_agent.end_mission:
-                print("Ending mission early...")
-                break
-            keeper.advance_by(0.05)
-            
+        # Loop until mission ends:
+        tick_stats = run_mission(my_mission, shoot_agent, move_agent, params, recorded if replay is not None else None,
+                                 trace, concurrent_polling, use_kalman_filter)
         print()
         print("Mission ended")
+        ticks = tick_stats.summary()
+        if ticks is not None:
+            print("Tick interval: mean {:.1f} ms, jitter {:.1f} ms, p99 {:.1f} ms".format(ticks["mean"] * 1e3, ticks["jitter"] * 1e3, ticks["p99"] * 1e3))
+        for agent in [shoot_agent, move_agent]:
+            print("{} commands: {} sent, {} suppressed".format(agent.name, *agent.command_counts()))
         if shoot_agent.total_shots > 0:
             print("Mission Accuracy: {}/{} -- {}".format(shoot_agent.mission_hits,shoot_agent.mission_shots,(shoot_agent.mission_hits*1.0/shoot_agent.mission_shots)))
             print("Total Accuracy: {}/{} -- {}".format(shoot_agent.total_hits,shoot_agent.total_shots,(shoot_agent.total_hits*1.0/shoot_agent.total_shots)))
@@ -228,12 +143,23 @@ try:
         else:
             mission_accuracies.append(0)
             # Mission has ended.
+        if use_pitch_lookup:
+            for high_angle, (max_error, mean_error) in shoot_agent.pitch_lookup_errors().items():
+                print("Pitch lookup error ({} angle): max {:.4f}, mean {:.4f} degrees".format("high" if high_angle else "low", max_error, mean_error))
+        if background_training and shoot_agent.model_age() is not None:
+            print("Aim model age: {:.2f}s, training latency: {:.3f}s".format(shoot_agent.model_age(), shoot_agent.training_latency()))
 except KeyboardInterrupt:
     shoot_agent.agent.sendCommand("quit")
     move_agent.agent.sendCommand("quit")
     pass
-#Save dataset to file
-FileIO.save_data("dataset",data_set)
+if trace is not None:
+    trace.close()
+#Save dataset to file.  A replay leaves the saved data set alone
+if replay is not None:
+    print(replay.summary())
+    print("Replay took {:.2f}s".format(time.time() - replay_started))
+else:
+    FileIO.save_data("dataset",data_set)
 # Graph results
 if graphing:
     Graphing.FitData(mission_accuracies)
@@ -0,0 +1,260 @@
+from functools import lru_cache
+from itertools import combinations_with_replacement
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def power_terms(features, degree):
+    #Column combinations in the same order as sklearn's PolynomialFeatures
+    return [list(combo) for d in range(1, degree+1) for combo in combinations_with_replacement(range(features), d)]
+
+def polynomial_features(data, degree):
+    '''
+    Equivalent to PolynomialFeatures(degree, include_bias=False).fit_transform(data)
+    without refitting a transformer for every call.
+    '''
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    return np.column_stack([np.prod(data[:,combo], axis=1) for combo in power_terms(data.shape[1], degree)])
+
+@lru_cache(maxsize=None)
+def square_columns(features, columns):
+    #Column of each feature's square in degree 2 polynomial features, and the feature it squares
+    squares = [(features + int(j*features - j*(j-1)/2), j) for j in range(features)]
+    squares = [(column, j) for (column, j) in squares if column < columns]
+    return [column for (column, j) in squares], [j for (column, j) in squares]
+
+def signed_quadratic_features(data, features, include_bias=False):
+    '''
+    Takes degree 2 polynomial features and gives each squared term the sign
+    of the feature it squares, so x^2 becomes x*|x|.
+    '''
+    data = np.asarray(data, dtype=float)
+    result = data.copy()
+    columns, signs = square_columns(features, data.shape[1])
+    result[:,columns] *= np.where(data[:,signs] < 0, -1.0, 1.0)
+    return result
+
+class ModelCache():
+    '''
+    Stores fitted models keyed by name along with the version of the data
+    they were fit on.  A model is refit once its table has changed by at
+    least refit_interval rows since the last fit.
+    Example:
+        cache = ModelCache(refit_interval=10)
+        model = cache.get("vert_shots", data_set.version("vert_shots"), fit_function)
+    '''
+
+    def __init__(self, refit_interval=1):
+        self.refit_interval = max(1, refit_interval)
+        self._entries = {}
+
+    def get(self, key, version, fit):
+        entry = self._entries.get(key)
+        if entry is None or version < entry[0] or version - entry[0] >= self.refit_interval:
+            entry = (version, fit())
+            self._entries[key] = entry
+        return entry[1]
+
+    def clear(self):
+        self._entries = {}
+
+
+class IncrementalRegression():
+    '''
+    Least squares fit with an intercept, equivalent to LinearRegression().fit(expand(X), y).
+    Keeps the running mean and centered co-moment matrix of [expand(X), y], so rows
+    can be added or removed in O(d^2) no matter how many rows have been seen.
+    Rows are given with the target value in the last column.
+    '''
+
+    def __init__(self, expand):
+        self.expand = expand
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._mean = None
+        self._comoment = None
+
+    def _stats(self, rows):
+        rows = np.atleast_2d(np.asarray(rows, dtype=float))
+        data = np.column_stack((self.expand(rows[:,:-1]), rows[:,-1]))
+        mean = data.mean(axis=0)
+        centered = data - mean
+        return data.shape[0], mean, centered.T @ centered
+
+    def add(self, rows):
+        if len(rows) == 0:
+            return
+        count, mean, comoment = self._stats(rows)
+        if self.count == 0:
+            self.count, self._mean, self._comoment = count, mean, comoment
+            return
+        #Merge batch statistics into the running statistics
+        total = self.count + count
+        delta = mean - self._mean
+        self._comoment = self._comoment + comoment + np.outer(delta, delta) * (self.count * count / total)
+        self._mean = self._mean + delta * (count / total)
+        self.count = total
+
+    def remove(self, rows):
+        if len(rows) == 0:
+            return
+        count, mean, comoment = self._stats(rows)
+        remaining = self.count - count
+        if remaining <= 0:
+            self.reset()
+            return
+        #Reverse of add: recover the statistics of the remaining rows
+        remaining_mean = (self._mean * self.count - mean * count) / remaining
+        delta = mean - remaining_mean
+        self._comoment = self._comoment - comoment - np.outer(delta, delta) * (remaining * count / self.count)
+        self._mean = remaining_mean
+        self.count = remaining
+
+    def fit(self, rows):
+        self.reset()
+        self.add(rows)
+        return self
+
+    def solve(self):
+        '''
+        Returns (coefficients, intercept) or None if no rows have been added.
+        '''
+        if self.count == 0:
+            return None
+        covariance = self._comoment[:-1,:-1]
+        target = self._comoment[:-1,-1]
+        #Rescale columns before solving since polynomial terms differ by orders of magnitude
+        variance = np.diag(covariance)
+        scale = np.zeros(variance.shape)
+        np.divide(1, np.sqrt(variance), out=scale, where=variance > 0)
+        scaled_coef = np.linalg.lstsq(covariance * np.outer(scale, scale), target * scale, rcond=None)[0]
+        coef = scaled_coef * scale
+        intercept = self._mean[-1] - self._mean[:-1] @ coef
+        return coef, intercept
+
+class LinearModel():
+    #Solved coefficients of an IncrementalRegression
+    def __init__(self, expand, coef, intercept):
+        self.expand = expand
+        self.coef = coef
+        self.intercept = intercept
+
+    def predict(self, data):
+        return self.expand(data) @ self.coef + self.intercept
+
+class TableModel():
+    '''
+    Keeps incremental regressions in step with one DataSet table.
+    Rows are routed to a regression by split(rows), which maps an array of rows
+    to an array of keys.  Without a split all rows go to the regression under None.  Only rows changed since the last sync are
+    applied, unless the DataSet journal no longer reaches back that far.
+    '''
+
+    def __init__(self, table, expand, split=None):
+        self.table = table
+        self.expand = expand
+        self.split = split
+        self.regressions = {}
+        self.version = None
+
+    def apply(self, sign, rows):
+        #Add (sign > 0) or remove rows from the regressions they belong to
+        for key, part in self.partition(rows):
+            if sign > 0:
+                self.regression(key).add(part)
+            else:
+                self.regression(key).remove(part)
+
+    def partition(self, rows):
+        if self.split is None:
+            return [(None, rows)]
+        keys = self.split(rows)
+        return [(key, rows[keys == key]) for key in set(keys.tolist())]
+
+    def regression(self, key):
+        if key not in self.regressions:
+            self.regressions[key] = IncrementalRegression(self.expand)
+        return self.regressions[key]
+
+    def sync(self, data_set):
+        version = data_set.version(self.table)
+        changes = data_set.changes_since(self.table, self.version)
+        if changes is None:
+            self.rebuild(np.asarray(getattr(data_set, self.table), dtype=float))
+        else:
+            for sign, rows in changes:
+                self.apply(sign, rows)
+        self.version = version
+
+    def rebuild(self, array):
+        self.regressions = {}
+        if array.shape[0] == 0:
+            return
+        for key, part in self.partition(array):
+            self.regression(key).fit(part)
+
+    def model(self, data_set, key=None):
+        #Returns a LinearModel fit on the current table, or None if there are no rows
+        self.sync(data_set)
+        solution = self.regression(key).solve()
+        if solution is None:
+            return None
+        return LinearModel(self.expand, *solution)
+
+class PitchLookupTable():
+    '''
+    Pitch model sampled on a regular (distance, elevation) grid.  Queries are
+    answered by bilinear interpolation, and return None outside the grid.
+    max_error and mean_error compare the interpolation with the model at the
+    center of every grid cell, where interpolation error is largest.
+    '''
+
+    def __init__(self, model, distance_bounds=(0, 64), elevation_bounds=(-32, 32), resolution=(129, 129)):
+        self.distance_bounds = distance_bounds
+        self.elevation_bounds = elevation_bounds
+        self.resolution = resolution
+        distances = np.linspace(distance_bounds[0], distance_bounds[1], resolution[0])
+        elevations = np.linspace(elevation_bounds[0], elevation_bounds[1], resolution[1])
+        grid_d, grid_e = np.meshgrid(distances, elevations, indexing="ij")
+        grid = model.predict(np.column_stack((grid_d.ravel(), grid_e.ravel()))).reshape(grid_d.shape)
+        self._step = ((distances[1] - distances[0]), (elevations[1] - elevations[0]))
+        self._array = grid
+        self._grid = grid.tolist()
+
+        #Bilinear interpolation at a cell center is the mean of its corners
+        center_d, center_e = np.meshgrid((distances[:-1] + distances[1:]) / 2, (elevations[:-1] + elevations[1:]) / 2, indexing="ij")
+        direct = model.predict(np.column_stack((center_d.ravel(), center_e.ravel()))).reshape(center_d.shape)
+        interpolated = (grid[:-1,:-1] + grid[1:,:-1] + grid[:-1,1:] + grid[1:,1:]) / 4
+        errors = np.abs(interpolated - direct)
+        self.max_error = errors.max()
+        self.mean_error = errors.mean()
+
+    def lookup(self, distance, elevation):
+        x = (distance - self.distance_bounds[0]) / self._step[0]
+        y = (elevation - self.elevation_bounds[0]) / self._step[1]
+        if not (0 <= x <= self.resolution[0] - 1 and 0 <= y <= self.resolution[1] - 1):
+            return None
+        i = min(int(x), self.resolution[0] - 2)
+        j = min(int(y), self.resolution[1] - 2)
+        tx = x - i
+        ty = y - j
+        row, next_row = self._grid[i], self._grid[i+1]
+        low = row[j] + (next_row[j] - row[j]) * tx
+        high = row[j+1] + (next_row[j+1] - row[j+1]) * tx
+        return low + (high - low) * ty
+
+    def lookup_many(self, distances, elevations):
+        #Vectorized lookup, with NaN outside the grid
+        grid = self._array
+        x = (np.asarray(distances, dtype=float) - self.distance_bounds[0]) / self._step[0]
+        y = (np.asarray(elevations, dtype=float) - self.elevation_bounds[0]) / self._step[1]
+        inside = (x >= 0) & (x <= self.resolution[0] - 1) & (y >= 0) & (y <= self.resolution[1] - 1)
+        i = np.clip(np.floor(x), 0, self.resolution[0] - 2).astype(int)
+        j = np.clip(np.floor(y), 0, self.resolution[1] - 2).astype(int)
+        tx = x - i
+        ty = y - j
+        low = grid[i,j] + (grid[i+1,j] - grid[i,j]) * tx
+        high = grid[i,j+1] + (grid[i+1,j+1] - grid[i,j+1]) * tx
+        return np.where(inside, low + (high - low) * ty, np.nan)
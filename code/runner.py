@@ -0,0 +1,114 @@
+'''
+Collects training data with several shooter/mover pairs at once.  Each pair
+gets its own two Minecraft clients on distinct ports and runs its missions in
+a worker process, starting from a copy of the saved data set.  After every
+mission a worker sends the rows it added and removed to this process, which
+merges them into one data set by value and saves it at the end.
+Usage:
+    python runner.py [mission type] [--pairs K] [--missions N] [--simulate] [--ballistic-prior]
+With --simulate each pair runs in simulator.py on a stepped clock, so pairs
+are CPU bound and data collection scales with the number of cores.
+'''
+import time
+import queue
+import random
+import argparse
+import multiprocessing
+from fileio import FileIO
+from clock import get_clock, set_clock, SteppedClock
+from malmo_agent import MalmoAgent, MalmoPython
+from session import make_mission, random_params, run_mission
+import simulator
+
+#MalmoAgent settings of the shooter, see refactoredtylertest.py
+SHOOTER_SETTINGS = {"refit_interval": 1, "min_aim_duration": 20}
+VERT_STEP_SIZE = 0.5
+HORI_STEP_SIZE = 0.5
+
+def client_ports(pairs, first_port=10001):
+    #Control ports of each pair's two clients: (10001, 10002), (10003, 10004), ...
+    return [(first_port + 2 * pair, first_port + 2 * pair + 1) for pair in range(pairs)]
+
+def launch_clients(ports):
+    #Start a Minecraft client on every port, like Multi-Client.py
+    import malmo.minecraftbootstrap
+    malmo.minecraftbootstrap.launch_minecraft([port for pair in ports for port in pair])
+
+def run_pair(pair, ports, mission_type, missions, data_set, simulate, seed, results, ballistic_prior=False):
+    '''
+    Worker process of one pair.  Puts (pair, shots, hits, changes) on results
+    after each mission, changes as from DataSet.take_changes(), and
+    (pair, None, None, None) when done.
+    '''
+    random.seed(seed)
+    if simulate:
+        set_clock(SteppedClock())
+    backend = simulator if simulate else MalmoPython
+    mission = make_mission(mission_type)
+    mission.backend = backend
+    agents = (backend.AgentHost(), backend.AgentHost())
+    shoot_agent = MalmoAgent("Slayer", agents[0], 0, 0, VERT_STEP_SIZE, HORI_STEP_SIZE, data_set, ballistic_prior=ballistic_prior, **SHOOTER_SETTINGS)
+    move_agent = MalmoAgent("Mover", agents[1], 0, 0, VERT_STEP_SIZE, HORI_STEP_SIZE, data_set)
+    data_set.log_changes()
+    try:
+        for i in range(missions):
+            get_clock().sleep(1)
+            params = random_params()
+            spec = backend.MissionSpec(mission.get_mission_xml(params), True)
+            mission.load_duo_mission(spec, agents, ports, "pair{}".format(pair))
+            run_mission(mission, shoot_agent, move_agent, params, concurrent_polling=not simulate)
+            results.put((pair, shoot_agent.mission_shots, shoot_agent.mission_hits, data_set.take_changes()))
+    finally:
+        results.put((pair, None, None, None))
+
+def run(pairs, missions, mission_type, simulate, first_port=10001, ballistic_prior=False):
+    #Run every pair to the end, merging their rows into the saved data set
+    ports = client_ports(pairs, first_port)
+    if not simulate:
+        launch_clients(ports)
+    store = FileIO.get_data_set()
+    results = multiprocessing.Queue()
+    seed = random.randrange(2**32)
+    workers = [multiprocessing.Process(target=run_pair, args=(pair, ports[pair], mission_type, missions, store, simulate, seed + pair, results, ballistic_prior),
+                                       daemon=True) for pair in range(pairs)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    finished = 0
+    completed = shots = hits = rows = 0
+    while finished < pairs:
+        try:
+            pair, mission_shots, mission_hits, changes = results.get(timeout=1)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                print("Every worker stopped before finishing")
+                break
+            continue
+        if changes is None:
+            finished += 1
+            continue
+        for table, (added, removed) in changes.items():
+            store.merge(table, added, removed)
+            rows += len(added) - len(removed)
+        completed += 1
+        shots += mission_shots
+        hits += mission_hits
+        print("Pair {} finished a mission: {}/{} hits, {} missions, {} rows so far".format(pair, mission_hits, mission_shots, completed, rows))
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+    print("{} pairs ran {} missions in {:.1f}s: {:.2f} missions/s, {:.0f} rows/s, {} shots, {} hits".format(
+        pairs, completed, elapsed, completed / elapsed, rows / elapsed, shots, hits))
+    FileIO.save_data("dataset", store)
+    return store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect training data with several client pairs at once")
+    parser.add_argument("mission_type", nargs="?", default="enemymission")
+    parser.add_argument("--pairs", type=int, default=2, help="shooter/mover pairs run at once")
+    parser.add_argument("--missions", type=int, default=20, help="missions run by each pair")
+    parser.add_argument("--first-port", type=int, default=10001, help="control port of the first client")
+    parser.add_argument("--simulate", action="store_true", help="run the missions in simulator.py")
+    parser.add_argument("--ballistic-prior", action="store_true", help="aim with the ballistic solver while the models have little data")
+    options = parser.parse_args()
+    run(options.pairs, options.missions, options.mission_type, options.simulate, options.first_port, options.ballistic_prior)
@@ -0,0 +1,59 @@
+import heapq
+import itertools
+
+class CommandScheduler():
+    '''
+    Timed Malmo commands in a heap keyed on the tick they are due.  dispatch()
+    sends every due command in (due tick, scheduling order) and costs
+    O(k log n) for k due commands.  Cancelled commands stay in the heap and are
+    skipped when they come up.
+    Example:
+        commands = CommandScheduler(agent_host)
+        commands.schedule("jump 1", 0)
+        handle = commands.schedule("jump 0", 20)
+        commands.cancel(handle)
+        commands.dispatch(tick)
+    '''
+
+    def __init__(self, host=None):
+        #host receives commands scheduled without one
+        self.host = host
+        self._heap = []
+        self._order = itertools.count()
+        #Handles of the commands not yet sent or cancelled
+        self._pending = set()
+
+    def schedule(self, command, due=0, host=None):
+        #Queue command for tick due, returns a handle for cancel()
+        handle = next(self._order)
+        heapq.heappush(self._heap, (due, handle, host if host is not None else self.host, command))
+        self._pending.add(handle)
+        return handle
+
+    def append(self, entry):
+        #Old list interface: entry is (host, command, due)
+        host, command, due = entry
+        return self.schedule(command, due, host)
+
+    def cancel(self, handle):
+        #Handles already sent or cancelled are ignored
+        self._pending.discard(handle)
+
+    def clear(self):
+        self._heap = []
+        self._pending.clear()
+
+    def dispatch(self, tick):
+        #Send every command due at or before tick, returns how many were sent
+        sent = 0
+        while self._heap and self._heap[0][0] <= tick:
+            due, handle, host, command = heapq.heappop(self._heap)
+            if handle not in self._pending:
+                continue
+            self._pending.discard(handle)
+            host.sendCommand(command)
+            sent += 1
+        return sent
+
+    def __len__(self):
+        return len(self._pending)
@@ -0,0 +1,126 @@
+'''
+The tick loop of a shooter/mover mission, shared by refactoredtylertest.py and
+runner.py.  run_mission() runs one mission that has already been started,
+from the chat setup commands until it ends.
+'''
+import random
+from Missions.staticflyingtarget import StaticFlyingTargetMission
+from Missions.simplifiedxstrafingmission import SimplifiedXStrafingMission
+from Missions.enemymission import EnemyMission
+from Missions.groundtargetmission import GroundTargetMission
+from Missions.staticstandingtarget import StaticStandingTargetMission
+from Missions.floatingtargetmission import FloatingTargetMission
+from Missions.dragonmission import DragonMission
+from malmo_agent import load_grid, find_entity_by_id
+from timekeeper import TimeKeeper
+from clock import get_clock
+from transform import Transform
+from estimator import KalmanEstimator
+from poller import DuoPoller, TickStats
+
+#Mission types by the name given on the command line
+MISSIONS = {
+    "enemymission": EnemyMission,
+    "staticflyingmission": StaticFlyingTargetMission,
+    "simplifiedxstrafingmission": SimplifiedXStrafingMission,
+    "groundtargetmission": GroundTargetMission,
+    "staticstandingmission": StaticStandingTargetMission,
+    "floatingtargetmission": FloatingTargetMission,
+    "dragonmission": DragonMission,
+}
+
+def make_mission(mission_type):
+    #Mission for a command line name, StaticFlyingTargetMission for unknown names
+    return MISSIONS.get(mission_type.lower(), StaticFlyingTargetMission)()
+
+def random_params():
+    #Random mission parameters, as used by get_mission_xml and chat_command_init
+    return (random.randint(10, 30)*random.randrange(-1, 2, 2), random.randint(10, 30)*random.randrange(-1, 2, 2), random.randint(10, 30))
+
+class Target():
+
+    def __init__(self):
+        self.transform = None
+        self.id = None
+
+def get_target(mission, obs, target, kalman_filter=False):
+    #Get existing target
+    new_transform = find_entity_by_id(obs,target.id)
+    if new_transform is None:
+        #Acquire new target
+        entity = mission.get_target(obs)
+        estimator = KalmanEstimator() if kalman_filter else None
+        target.transform = Transform(estimator=estimator).update(entity, obs["time"]) if entity is not None else None
+        target.id = entity["id"] if (entity is not None) else None
+    else:
+        target.transform.update(new_transform, obs["time"])
+    return target
+
+def run_mission(mission, shoot_agent, move_agent, params, frames=None, trace=None, concurrent_polling=False, kalman_filter=False):
+    '''
+    Run the tick loop of a started mission until it ends.  Frames come from
+    frames (a DuoPoller or a replayed mission) when given, else from a poller
+    or load_grid.  trace records every tick.  Returns the loop's TickStats.
+    '''
+    shoot_agent.reset()
+    shoot_agent.reset_shoot_loop()
+    move_agent.reset()
+    keeper = TimeKeeper()
+
+    mission.chat_command_init(shoot_agent,move_agent,params)
+    shoot_agent.agent.sendCommand("use 1")
+
+    world_state = shoot_agent.agent.peekWorldState()
+    shoot_agent.reset_shoot_loop()
+    target = Target()
+    first_target_found = False
+    initial_delay = 5
+    poller = frames
+    if poller is None and concurrent_polling:
+        poller = DuoPoller([shoot_agent.agent, move_agent.agent])
+    tick_stats = TickStats()
+    while world_state.is_mission_running:
+        tick_stats.tick()
+        if poller is not None:
+            frames = poller.next_frames()
+            shooter_obs, mover_obs = frames if frames else (None, None)
+        else:
+            shooter_obs = load_grid(shoot_agent.agent)
+            mover_obs = load_grid(move_agent.agent)
+        if not shooter_obs or not mover_obs:
+            break
+        if trace is not None:
+            trace.tick((shooter_obs, mover_obs), get_clock().time())
+        move_agent.step(mover_obs)
+
+        #get target
+        target = get_target(mission, mover_obs, target, kalman_filter)
+        if target.transform is not None:
+            first_target_found = True
+        if target.transform is None and first_target_found:
+            #End mission early if no enemies remaining
+            break
+
+        #Run shooter ticks if target exists
+        if initial_delay > 0:
+            initial_delay -= 1
+        else:
+            if shoot_agent.shooter_step(shooter_obs, move_agent, target):
+                #Change mover direction
+                mission.ai_toggle(move_agent, target.transform)
+
+        mission.ai_step(move_agent, target.transform)
+
+        shoot_agent.flush_commands()
+        move_agent.flush_commands()
+        #If shoot agent hits target, end mission early
+        if shoot_agent.end_mission:
+            print("Ending mission early...")
+            break
+        keeper.advance_by(0.05)
+
+    if poller is not None:
+        poller.stop()
+    if trace is not None:
+        trace.end_mission()
+    return tick_stats
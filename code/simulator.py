@@ -0,0 +1,439 @@
+'''
+Headless stand-in for the parts of MalmoPython used by Mission, MalmoAgent and
+refactoredtylertest.py, so missions can run without Minecraft.  It provides
+AgentHost, MissionSpec, MissionRecordSpec, ClientPool and ClientInfo, and
+simulates a flat world at 20 ticks per second:
+    - players turning, pitching, walking, strafing, jumping and flying
+      (continuous movement commands)
+    - bows (use 1 / use 0) firing arrows that follow Minecraft's arrow physics
+      from ballistics.py, bouncing off invulnerable players and sticking in
+      the ground
+    - /summon, /kill and /gamemode chat commands, and mobs that wander on the
+      ground or, for the ender dragon, circle overhead
+Observations are JSON in the format of ObservationFromNearbyEntities.
+The world follows get_clock(), so with a SteppedClock it runs as fast as the
+tick loop does.
+Example:
+    import simulator
+    my_mission.backend = simulator
+'''
+import json
+import math
+import random
+import re
+import threading
+import uuid
+import xml.etree.ElementTree as ElementTree
+import ballistics
+from clock import get_clock
+
+TICK_LENGTH = 1.0 / ballistics.TICKS_PER_SECOND
+GROUND = 4.0
+#blocks/tick
+WALK_SPEED = 0.21585
+FLY_SPEED = 0.545
+FLY_VERTICAL_SPEED = 0.375
+JUMP_VELOCITY = 0.42
+PLAYER_GRAVITY = 0.08
+PLAYER_DRAG = 0.98
+#Ticks a bow has to be drawn for a full power shot
+BOW_DRAW_TICKS = 20
+#(half width, height) of entity hit boxes
+HIT_BOXES = {"player": (0.3, 1.8), "Horse": (0.7, 1.6), "EnderDragon": (4.0, 4.0)}
+DEFAULT_HIT_BOX = (0.45, 1.4)
+#Summon ids to observation names
+MOB_NAMES = {"horse": "Horse", "ender_dragon": "EnderDragon", "enderdragon": "EnderDragon", "pig": "Pig",
+             "cow": "Cow", "chicken": "Chicken", "creeper": "Creeper", "spider": "Spider"}
+SURVIVAL, CREATIVE, ADVENTURE, SPECTATOR = 0, 1, 2, 3
+GAMEMODES = {"survival": SURVIVAL, "creative": CREATIVE, "adventure": ADVENTURE, "spectator": SPECTATOR}
+
+
+class ClientInfo():
+    def __init__(self, address="127.0.0.1", port=10000):
+        self.ip_address = address
+        self.control_port = port
+
+class ClientPool():
+    def __init__(self):
+        self.clients = []
+
+    def add(self, client):
+        self.clients.append(client)
+
+class MissionRecordSpec():
+    def __init__(self, destination=None):
+        self.destination = destination
+
+class MissionSpec():
+    '''
+    Parsed mission XML.  Both agents of a mission start with the same
+    MissionSpec, which is how they end up in the same simulated world.
+    seed makes mob movement and entity ids repeatable.
+    '''
+
+    def __init__(self, xml, validate=True, seed=None):
+        self.xml = xml
+        self.seed = seed
+        self.world = None
+        root = ElementTree.fromstring(xml.strip())
+        #Drop the Malmo namespace from tag names
+        for element in root.iter():
+            element.tag = element.tag.split("}")[-1]
+        time_up = root.find(".//ServerQuitFromTimeUp")
+        self.time_limit = float(time_up.get("timeLimitMs")) / 1000 if time_up is not None else None
+        self.agents = []
+        for section in root.iter("AgentSection"):
+            placement = section.find(".//Placement")
+            movement = section.find(".//ContinuousMovementCommands")
+            entity_range = section.find(".//ObservationFromNearbyEntities/Range")
+            self.agents.append({
+                "name": section.findtext("Name"),
+                "mode": GAMEMODES.get(section.get("mode", "Survival").lower(), SURVIVAL),
+                "position": tuple(float(placement.get(axis, 0)) for axis in "xyz") if placement is not None else (0.5, GROUND, 0.5),
+                "yaw": float(placement.get("yaw", 0)) if placement is not None else 0.0,
+                "pitch": float(placement.get("pitch", 0)) if placement is not None else 0.0,
+                "turn_speed": float(movement.get("turnSpeedDegs", 180)) if movement is not None else 180.0,
+                "range": tuple(float(entity_range.get(axis + "range")) for axis in "xyz") if entity_range is not None else None,
+            })
+
+    def setViewpoint(self, viewpoint):
+        pass
+
+class Observation():
+    def __init__(self, text):
+        self.text = text
+
+class WorldState():
+    def __init__(self, has_mission_begun=False, is_mission_running=False, observations=(), count=0, errors=()):
+        self.has_mission_begun = has_mission_begun
+        self.is_mission_running = is_mission_running
+        self.observations = list(observations)
+        self.number_of_observations_since_last_state = count
+        self.errors = list(errors)
+        self.rewards = []
+        self.video_frames = []
+
+class Entity():
+    def __init__(self, world, name, position, yaw=0.0, pitch=0.0):
+        self.id = str(uuid.UUID(int=world.rng.getrandbits(128)))
+        self.name = name
+        self.x, self.y, self.z = position
+        self.yaw = yaw
+        self.pitch = pitch
+        self.motion = [0.0, 0.0, 0.0]
+        self.life = 20.0
+        self.removed = False
+
+    def observe(self):
+        return {"yaw": self.yaw, "x": self.x, "y": self.y, "z": self.z, "pitch": self.pitch, "id": self.id,
+                "motionX": self.motion[0], "motionY": self.motion[1], "motionZ": self.motion[2],
+                "life": self.life, "name": self.name}
+
+class Player(Entity):
+    def __init__(self, world, spec):
+        Entity.__init__(self, world, spec["name"], spec["position"], spec["yaw"], spec["pitch"])
+        self.mode = spec["mode"]
+        self.turn_speed = spec["turn_speed"]
+        self.range = spec["range"]
+        self.flying = self.mode == SPECTATOR
+        self.inputs = {"move": 0.0, "strafe": 0.0, "turn": 0.0, "pitch": 0.0, "jump": 0.0, "crouch": 0.0}
+        self.drawing_since = None
+        self.pending_observations = 0
+
+    def hit_box(self):
+        return HIT_BOXES["player"]
+
+    def step(self, world):
+        self.yaw = ((self.yaw + self.inputs["turn"] * self.turn_speed * TICK_LENGTH + 180) % 360) - 180
+        self.pitch = max(-90.0, min(90.0, self.pitch + self.inputs["pitch"] * self.turn_speed * TICK_LENGTH))
+        speed = FLY_SPEED if self.flying else WALK_SPEED
+        yaw = math.radians(self.yaw)
+        forward, right = self.inputs["move"] * speed, self.inputs["strafe"] * speed
+        #Yaw 0 faces +z, and the right hand then points to -x
+        self.motion[0] = -math.sin(yaw) * forward - math.cos(yaw) * right
+        self.motion[2] = math.cos(yaw) * forward - math.sin(yaw) * right
+        if self.flying:
+            self.motion[1] = FLY_VERTICAL_SPEED * (self.inputs["jump"] > 0) - FLY_VERTICAL_SPEED * (self.inputs["crouch"] > 0)
+        else:
+            if self.y <= GROUND and self.inputs["jump"] > 0:
+                self.motion[1] = JUMP_VELOCITY
+            self.motion[1] = (self.motion[1] - PLAYER_GRAVITY) * PLAYER_DRAG
+        self.x += self.motion[0]
+        self.y += self.motion[1]
+        self.z += self.motion[2]
+        if self.y <= GROUND:
+            self.y = GROUND
+            self.motion[1] = 0.0
+
+    def command(self, world, command):
+        verb, _, argument = command.partition(" ")
+        if verb in self.inputs:
+            self.inputs[verb] = float(argument)
+        elif verb == "use":
+            if float(argument) > 0:
+                if self.drawing_since is None:
+                    self.drawing_since = world.tick
+            elif self.drawing_since is not None:
+                world.shoot(self, world.tick - self.drawing_since)
+                self.drawing_since = None
+        elif verb == "chat":
+            world.chat(self, argument)
+        elif verb == "quit":
+            world.running = False
+
+    def sees(self, entity):
+        if self.range is None:
+            return False
+        return abs(entity.x - self.x) <= self.range[0] and abs(entity.y - self.y) <= self.range[1] and abs(entity.z - self.z) <= self.range[2]
+
+class Mob(Entity):
+    '''
+    A mob that wanders on the ground, changing heading every few seconds.
+    '''
+
+    def __init__(self, world, name, position):
+        Entity.__init__(self, world, name, position, yaw=world.rng.uniform(-180, 180))
+        self.speed = 0.0
+        self.wander_ticks = 0
+
+    def hit_box(self):
+        return HIT_BOXES.get(self.name, DEFAULT_HIT_BOX)
+
+    def step(self, world):
+        if self.wander_ticks <= 0:
+            self.yaw = world.rng.uniform(-180, 180)
+            self.speed = world.rng.choice([0.0, world.rng.uniform(0.05, 0.2)])
+            self.wander_ticks = world.rng.randint(40, 120)
+        self.wander_ticks -= 1
+        yaw = math.radians(self.yaw)
+        self.motion = [-math.sin(yaw) * self.speed, 0.0, math.cos(yaw) * self.speed]
+        self.x += self.motion[0]
+        self.z += self.motion[2]
+
+class Dragon(Mob):
+    '''
+    Ender dragon circling its summon point, rising and falling as it goes.
+    '''
+
+    def __init__(self, world, name, position):
+        Mob.__init__(self, world, name, position)
+        self.center = position
+        self.radius = world.rng.uniform(20, 40)
+        self.angle = 0.0
+        self.angular_speed = 0.5 / self.radius
+
+    def step(self, world):
+        self.angle += self.angular_speed
+        x = self.center[0] + self.radius * math.cos(self.angle)
+        y = self.center[1] + 5 * math.sin(3 * self.angle)
+        z = self.center[2] + self.radius * math.sin(self.angle)
+        self.motion = [x - self.x, y - self.y, z - self.z]
+        self.yaw = math.degrees(math.atan2(-self.motion[0], self.motion[2]))
+        self.x, self.y, self.z = x, y, z
+
+class Arrow(Entity):
+    def __init__(self, world, shooter, speed):
+        yaw, pitch = math.radians(shooter.yaw), math.radians(shooter.pitch)
+        position = (shooter.x, shooter.y + ballistics.LAUNCH_HEIGHT, shooter.z)
+        Entity.__init__(self, world, "Arrow", position, shooter.yaw, shooter.pitch)
+        #Pitch is positive looking down
+        self.motion = [-math.sin(yaw) * math.cos(pitch) * speed, -math.sin(pitch) * speed, math.cos(yaw) * math.cos(pitch) * speed]
+        self.shooter = shooter
+        self.fired = world.tick
+        self.stuck = False
+        #Invulnerable player the arrow bounced off, which it passes through from then on
+        self.bounced_off = None
+
+    def observe(self):
+        observation = Entity.observe(self)
+        del observation["life"]
+        return observation
+
+    def step(self, world):
+        if self.stuck:
+            return
+        start = (self.x, self.y, self.z)
+        end = (self.x + self.motion[0], self.y + self.motion[1], self.z + self.motion[2])
+        hit = world.first_hit(self, start, end)
+        if hit is not None:
+            entity, fraction = hit
+            end = tuple(start[i] + fraction * (end[i] - start[i]) for i in range(3))
+            if isinstance(entity, Player) and entity.mode != SURVIVAL:
+                #Invulnerable players knock the arrow back, after which it falls away from them
+                self.motion = [-0.1 * m for m in self.motion]
+                self.bounced_off = entity
+            else:
+                entity.life -= math.ceil(2 * math.sqrt(sum(m * m for m in self.motion)))
+                if entity.life <= 0 and not isinstance(entity, Player):
+                    entity.removed = True
+                self.x, self.y, self.z = end
+                self.removed = True
+                return
+        self.x, self.y, self.z = end
+        if self.y <= GROUND:
+            self.y = GROUND
+            self.motion = [0.0, 0.0, 0.0]
+            self.stuck = True
+            return
+        self.motion = [self.motion[0] * ballistics.DRAG, self.motion[1] * ballistics.DRAG - ballistics.GRAVITY, self.motion[2] * ballistics.DRAG]
+        horizontal = math.hypot(self.motion[0], self.motion[2])
+        self.yaw = math.degrees(math.atan2(-self.motion[0], self.motion[2]))
+        self.pitch = -math.degrees(math.atan2(self.motion[1], horizontal))
+
+def segment_box_fraction(start, end, low, high):
+    #Fraction along start->end where the segment enters the box, or None
+    enter, leave = 0.0, 1.0
+    for i in range(3):
+        delta = end[i] - start[i]
+        if delta == 0:
+            if start[i] < low[i] or start[i] > high[i]:
+                return None
+            continue
+        first, second = (low[i] - start[i]) / delta, (high[i] - start[i]) / delta
+        if first > second:
+            first, second = second, first
+        enter, leave = max(enter, first), min(leave, second)
+        if enter > leave:
+            return None
+    return enter
+
+class World():
+    '''
+    One simulated mission shared by the agents that started it.  The world
+    ticks lazily: whenever an agent looks at it, it runs the ticks that are due
+    since the mission started.
+    '''
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.players = [Player(self, agent) for agent in spec.agents]
+        self.entities = list(self.players)
+        self.tick = 0
+        self.start = get_clock().time()
+        self.running = True
+        self.lock = threading.RLock()
+
+    def advance(self):
+        #Run every tick that is due by now
+        with self.lock:
+            due = int((get_clock().time() - self.start) / TICK_LENGTH)
+            while self.running and self.tick < due:
+                self.step()
+
+    def step(self):
+        self.tick += 1
+        for entity in list(self.entities):
+            if not entity.removed:
+                entity.step(self)
+        self.entities = [entity for entity in self.entities if not entity.removed]
+        for player in self.players:
+            player.pending_observations += 1
+        if self.spec.time_limit is not None and self.tick * TICK_LENGTH >= self.spec.time_limit:
+            self.running = False
+
+    def observation(self, player):
+        mobs = [entity.observe() for entity in self.entities if player.sees(entity)]
+        return json.dumps({"Mobs": mobs})
+
+    def first_hit(self, arrow, start, end):
+        #(entity, fraction) of the first entity the arrow's path enters this tick
+        best = None
+        for entity in self.entities:
+            if entity is arrow or entity is arrow.bounced_off or isinstance(entity, Arrow) or entity.removed:
+                continue
+            if isinstance(entity, Player) and (entity.mode == SPECTATOR or (entity is arrow.shooter and self.tick - arrow.fired < 5)):
+                continue
+            width, height = entity.hit_box()
+            fraction = segment_box_fraction(start, end, (entity.x - width, entity.y, entity.z - width), (entity.x + width, entity.y + height, entity.z + width))
+            if fraction is not None and (best is None or fraction < best[1]):
+                best = (entity, fraction)
+        return best
+
+    def shoot(self, player, draw_ticks):
+        #Bow power as in Minecraft: (c^2 + 2c) / 3 for c the drawn fraction
+        drawn = min(1.0, draw_ticks / BOW_DRAW_TICKS)
+        power = (drawn * drawn + 2 * drawn) / 3
+        if power < 0.1:
+            return
+        self.entities.append(Arrow(self, player, ballistics.ARROW_SPEED * power))
+
+    def chat(self, player, text):
+        if not text.startswith("/"):
+            return
+        words = text[1:].split()
+        if words[0] == "kill" and len(words) > 1 and words[1].startswith("@e") and "type=!player" in words[1]:
+            for entity in self.entities:
+                if not isinstance(entity, Player):
+                    entity.removed = True
+        elif words[0] == "gamemode" and len(words) > 1:
+            mode = GAMEMODES.get(words[1], int(words[1]) if words[1].isdigit() else SURVIVAL)
+            player.mode = mode
+            if mode == SPECTATOR:
+                player.flying = True
+            elif mode != CREATIVE:
+                player.flying = False
+        elif words[0] == "summon" and len(words) > 1:
+            self.summon(player, words[1], words[2:5])
+
+    def summon(self, player, kind, coordinates):
+        kind = kind.replace("minecraft:", "").lower()
+        name = MOB_NAMES.get(kind, kind.capitalize())
+        position = [player.x, player.y, player.z]
+        for i, coordinate in enumerate(coordinates):
+            if coordinate.startswith("~"):
+                position[i] = position[i] + (float(coordinate[1:]) if len(coordinate) > 1 else 0.0)
+            elif re.match(r"^-?[\d.]+$", coordinate):
+                position[i] = float(coordinate)
+        mob_class = Dragon if name == "EnderDragon" else Mob
+        self.entities.append(mob_class(self, name, tuple(position)))
+
+class AgentHost():
+    '''
+    Simulated MalmoPython.AgentHost.  startMission with the same MissionSpec
+    for roles 0 and 1 puts both agents in one world.
+    '''
+
+    def __init__(self):
+        self.world = None
+        self.player = None
+
+    def parse(self, args):
+        pass
+
+    def receivedArgument(self, name):
+        return False
+
+    def getUsage(self):
+        return ""
+
+    def startMission(self, mission, client_pool, record, role, experiment_id):
+        if mission.world is None or not mission.world.running:
+            mission.world = World(mission)
+        self.world = mission.world
+        self.player = self.world.players[role]
+
+    def sendCommand(self, command):
+        if self.world is None:
+            return
+        with self.world.lock:
+            self.world.advance()
+            if self.world.running:
+                self.player.command(self.world, command)
+
+    def peekWorldState(self):
+        return self._world_state(consume=False)
+
+    def getWorldState(self):
+        return self._world_state(consume=True)
+
+    def _world_state(self, consume):
+        if self.world is None:
+            return WorldState()
+        with self.world.lock:
+            self.world.advance()
+            count = self.player.pending_observations
+            observations = [Observation(self.world.observation(self.player))] if count > 0 else []
+            if consume:
+                self.player.pending_observations = 0
+            return WorldState(True, self.world.running, observations, count)
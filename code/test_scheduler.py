@@ -0,0 +1,36 @@
+'''
+Checks of scheduler.py.  Run with python -m pytest.
+'''
+from scheduler import CommandScheduler
+
+class Host():
+    #Records the commands sent to it, like a Malmo agent host would receive them
+    def __init__(self):
+        self.sent = []
+
+    def sendCommand(self, command):
+        self.sent.append(command)
+
+def test_cancel_after_dispatch_keeps_count():
+    host = Host()
+    commands = CommandScheduler(host)
+    handle = commands.schedule("jump 1", 0)
+    commands.schedule("jump 0", 20)
+    assert commands.dispatch(0) == 1
+    commands.cancel(handle)
+    commands.cancel(handle + 100)
+    assert len(commands) == 1
+    assert commands.dispatch(20) == 1
+    assert len(commands) == 0
+    assert host.sent == ["jump 1", "jump 0"]
+
+def test_cancelled_command_is_not_sent():
+    host = Host()
+    commands = CommandScheduler(host)
+    commands.schedule("use 1", 0)
+    handle = commands.schedule("use 0", 5)
+    commands.cancel(handle)
+    assert len(commands) == 1
+    assert commands.dispatch(10) == 1
+    assert host.sent == ["use 1"]
+    assert len(commands) == 0
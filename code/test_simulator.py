@@ -0,0 +1,33 @@
+'''
+Checks of simulator.py's arrow physics.  Run with python -m pytest.
+'''
+import simulator
+from malmo_agent import ArrowTracker
+
+#A shooter facing +z and an invulnerable mover 10 blocks in front of it
+MISSION_XML = '''<Mission>
+  <AgentSection mode="Survival"><Name>Slayer</Name><AgentStart><Placement x="0.5" y="4" z="0.5" yaw="0" pitch="0"/></AgentStart></AgentSection>
+  <AgentSection mode="Creative"><Name>Mover</Name><AgentStart><Placement x="0.5" y="4" z="10.5" yaw="180"/></AgentStart></AgentSection>
+</Mission>'''
+
+class StillShooter():
+    #The parts of MalmoAgent an ArrowTracker uses
+    def __init__(self, player):
+        self.transform = player.observe()
+
+    def analyze_arrow_trajectory(self, *args):
+        pass
+
+def test_arrow_bounces_off_invulnerable_player():
+    world = simulator.World(simulator.MissionSpec(MISSION_XML, True, seed=0))
+    shooter, mover = world.players
+    world.shoot(shooter, simulator.BOW_DRAW_TICKS)
+    arrow = world.entities[-1]
+    tracker = ArrowTracker(StillShooter(shooter), arrow.id, mover.id, None, None, settle_ticks=5)
+    while not tracker.delete_me:
+        world.step()
+        tracker.step({"Mobs": [entity.observe() for entity in world.entities if not entity.removed], "time": world.tick * simulator.TICK_LENGTH})
+    assert tracker.outcome == "bounced"
+    #The arrow falls back from the mover instead of hanging on its hit box
+    assert arrow.z < mover.z - simulator.HIT_BOXES["player"][0]
+    assert arrow.y < mover.y + simulator.HIT_BOXES["player"][1]
@@ -0,0 +1,54 @@
+'''
+Checks of trainer.py.  Run with python -m pytest.
+'''
+import threading
+import numpy as np
+from dataset import DataSet
+from regression import TableModel, polynomial_features
+from trainer import BackgroundTrainer
+
+class FeedingModel(TableModel):
+    '''
+    TableModel that requests another refit every time the worker applies rows,
+    so the trainer's queue is never empty while feeding is set.
+    '''
+
+    def __init__(self, table, data_set, feeding):
+        TableModel.__init__(self, table, lambda x: polynomial_features(x, 1))
+        self.data_set = data_set
+        self.feeding = feeding
+        self.trainer = None
+
+    def apply(self, sign, rows):
+        TableModel.apply(self, sign, rows)
+        if self.feeding.is_set():
+            self.data_set.append(self.table, [1.0, 2.0, 3.0])
+            self.trainer.update(self.data_set)
+
+def test_publishes_while_queue_stays_busy():
+    data_set = DataSet()
+    feeding = threading.Event()
+    feeding.set()
+    model = FeedingModel("vert_shots", data_set, feeding)
+    table_models = {"hori_shots": TableModel("hori_shots", lambda x: polynomial_features(x, 1)),
+                    "hori_leading": TableModel("hori_leading", lambda x: polynomial_features(x, 1)),
+                    "vert_shots": model,
+                    "vert_leading": TableModel("vert_leading", lambda x: polynomial_features(x, 1))}
+    trainer = BackgroundTrainer(table_models)
+    model.trainer = trainer
+    data_set.extend("vert_shots", np.random.default_rng(0).random((20, 3)))
+    trainer.update(data_set)
+    data_set.append("vert_shots", [1.0, 2.0, 3.0])
+    trainer.update(data_set)
+    #Published while the worker keeps queueing refits for itself
+    published = None
+    for i in range(200):
+        published = trainer.snapshot
+        if published is not None:
+            break
+        threading.Event().wait(0.01)
+    feeding.clear()
+    trainer.wait()
+    trainer.stop()
+    assert published is not None
+    assert ("vert_shots", None) in published.models
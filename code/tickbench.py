@@ -0,0 +1,335 @@
+'''
+Per-stage latency of one shooter tick.  Drives set_obs, calculate_desired_aim,
+track_arrows_step, analyze_arrow_trajectory and shooter_step on synthetic
+frames (or the frames of a recorded trace) for data sets of 1k to 1M rows,
+different numbers of arrows in flight and of other entities, and reports the
+p50 and p99 latency and the p50 peak allocation of each stage.
+Usage:
+    python tickbench.py                          runs the suite
+    python tickbench.py --quick                  smaller data sets and fewer samples
+    python tickbench.py --trace t.trace.gz       frames from a recorded trace
+    python tickbench.py --save baseline.json     saves the results as a baseline
+    python tickbench.py --baseline baseline.json exits with 1 if a stage regressed
+    python tickbench.py --check baseline.json    best of 3 quick runs against a quick baseline,
+                                                 with a tolerance of 100%
+A stage regresses when its p50 latency or peak allocation grows by more than
+the tolerance (default 50%) over the baseline, or its p99 by more than twice
+the tolerance, ignoring growth under 20 us or 1 KB.  Timings are only
+comparable on the same machine, so baselines are not checked in: save one
+from the unchanged code on the machine that runs the check with
+    python tickbench.py --quick --repeat 3 --save baseline.json
+'''
+import sys
+import time
+import json
+import argparse
+import tracemalloc
+import numpy as np
+from observation import Frame
+from clock import set_clock, SteppedClock
+from dataset import DataSet
+from transform import Transform
+from malmo_agent import MalmoAgent, ArrowTracker, angle_clamp
+
+STAGES = ["set_obs", "calculate_desired_aim", "desired_aim_refit", "track_arrows_step", "analyze_arrow_trajectory", "shooter_step"]
+DEFAULT_CASE = {"rows": 10000, "arrows": 5, "entities": 4}
+SWEEPS = {"rows": [1000, 10000, 100000, 1000000], "arrows": [0, 5, 25], "entities": [4, 50, 500]}
+QUICK_SWEEPS = {"rows": [1000, 10000, 100000], "arrows": [0, 5, 25], "entities": [4, 50, 500]}
+#Ticks an arrow flies before it hits the ground and disappears
+ARROW_FLIGHT = 40
+
+class NullHost():
+    #Agent host that drops every command
+    def sendCommand(self, command):
+        pass
+
+class Target():
+    def __init__(self, entity, time):
+        self.id = entity["id"]
+        self.transform = Transform().update(entity, time)
+
+def entity(name, id, position, motion=(0, 0, 0)):
+    x, y, z = position
+    return {"yaw": 0.0, "x": float(x), "y": float(y), "z": float(z), "pitch": 0.0, "id": id,
+            "motionX": float(motion[0]), "motionY": float(motion[1]), "motionZ": float(motion[2]), "life": 20.0, "name": name}
+
+def synthetic_frames(rng, ticks, arrows, entities):
+    '''
+    Frames of a shooter at the origin and a target strafing 25 blocks away,
+    with arrows flying at it in a staggered stream and other mobs standing
+    around.  Each arrow is shot again with a new id once it lands.
+    '''
+    bystanders = [entity("Horse", "horse-{}".format(i), rng.uniform((-40, 4, -40), (40, 10, 40))) for i in range(entities)]
+    frames = []
+    for tick in range(ticks):
+        t = tick * 0.05
+        target = (10 + 6 * np.sin(t), 10, 25)
+        mobs = [entity("Slayer", "slayer", (0.5, 4, 0.5)), entity("Mover", "mover", target, (0.3 * np.cos(t), 0, 0))]
+        mobs += bystanders
+        for a in range(arrows):
+            age = (tick + a * ARROW_FLIGHT // max(1, arrows)) % (ARROW_FLIGHT + 10)
+            flight = tick // (ARROW_FLIGHT + 10)
+            if age < ARROW_FLIGHT:
+                #Straight at the target, then lying where it landed
+                position = (0.5 + 0.25 * age, 5.6 + 0.5 * age - 0.0125 * age**2, 0.5 + 0.6 * age)
+            else:
+                position = (10.5, 5.6 + 0.5 * ARROW_FLIGHT - 0.0125 * ARROW_FLIGHT**2, 24.5)
+            mobs.append(entity("Arrow", "arrow-{}-{}".format(a, flight), position))
+        frame = Frame({"Mobs": mobs})
+        frame["time"] = t
+        frames.append((frame, frame))
+    return frames
+
+def trace_frames(path, ticks):
+    #The first ticks frames of a recorded trace, as (shooter frame, mover frame)
+    from missiontrace import TraceReplay
+    frames = []
+    for mission in TraceReplay(path).missions():
+        for tick_time, (shooter, mover) in mission.ticks:
+            frames.append((Frame(shooter), Frame(mover)))
+            if len(frames) >= ticks:
+                return frames
+    return frames
+
+def synthetic_data_set(rng, rows):
+    #A data set with rows rows in every table, shaped like the recorded ones
+    distance = rng.uniform(5, 60, rows)
+    elevation = rng.uniform(-10, 20, rows)
+    pitch = np.degrees(np.arctan2(elevation, distance)) + 0.2 * distance + rng.normal(0, 0.5, rows)
+    angle = rng.uniform(-60, 60, rows)
+    velocity = rng.normal(0, 0.3, (rows, 3))
+    data_set = DataSet()
+    data_set.extend("vert_shots", np.column_stack((distance, elevation, pitch)))
+    data_set.extend("vert_leading", np.column_stack((distance, elevation, velocity[:,1], 2 * velocity[:,1] * distance / 30)))
+    data_set.extend("hori_shots", np.column_stack((angle, angle + rng.normal(0, 1, rows))))
+    data_set.extend("hori_leading", np.column_stack((distance, velocity[:,0], velocity[:,2], 2 * velocity[:,0] * distance / 30)))
+    return data_set
+
+def percentiles(samples):
+    samples = np.asarray(samples)
+    return float(np.percentile(samples, 50)), float(np.percentile(samples, 99))
+
+class StageRunner():
+    '''
+    Runs the stages of one case.  Every stage gets the same warmed up agents;
+    setup done for a call (feeding frames, starting trackers) is not timed.
+    '''
+
+    def __init__(self, frames, data_set, samples, allocation_samples):
+        self.frames = frames
+        self.data_set = data_set
+        self.samples = samples
+        self.allocation_samples = allocation_samples
+        self.clock = SteppedClock()
+        set_clock(self.clock)
+        self.shoot_agent = MalmoAgent("Slayer", NullHost(), 0, 0, 0.5, 0.5, data_set, ballistic_prior=True, tracker_settle_ticks=5)
+        self.move_agent = MalmoAgent("Mover", NullHost(), 0, 0, 0.5, 0.5, data_set)
+        self.tick = 0
+        self.target = None
+        self.tracked = set()
+        self.advance()
+        #Fit every model once, so the first timed call is not a full fit
+        self.shoot_agent.calculate_desired_aim(self.target.transform)
+
+    def advance(self, shooter_sees=True):
+        #Move to the next frame.  Frames are replayed in a loop, so they are restamped
+        #to keep time moving forward
+        if self.tick % len(self.frames) == 0:
+            #Arrow ids repeat from here on, so only the arrows still tracked count as seen
+            self.tracked = {tracker.arrow_id for tracker in self.shoot_agent.arrow_trackers}
+        shooter, mover = self.frames[self.tick % len(self.frames)]
+        self.tick += 1
+        self.clock.now = self.tick * 0.05
+        shooter["time"] = mover["time"] = self.clock.now
+        if shooter_sees:
+            self.shoot_agent.set_obs(shooter)
+        self.move_agent.step(mover)
+        target = self.shoot_agent_target(mover)
+        if target is not None:
+            if self.target is None or self.target.id != target["id"]:
+                self.target = Target(target, self.clock.now)
+            else:
+                self.target.transform.update(target, self.clock.now)
+        return shooter, mover
+
+    def shoot_agent_target(self, mover):
+        movers = mover.index.named("Mover")
+        return movers[0] if movers else None
+
+    def aim_data(self):
+        yaw = angle_clamp(self.shoot_agent.transform["yaw"])
+        return [(yaw, 10.0, self.clock.now - 0.05 * i) for i in range(20, 0, -1)]
+
+    def start_trackers(self, mover):
+        #Track every arrow of the frame, like shooter_step does for the arrows it shoots
+        for arrow in mover.index.named("Arrow"):
+            if arrow["id"] not in self.tracked:
+                self.tracked.add(arrow["id"])
+                self.shoot_agent.arrow_trackers.append(ArrowTracker(self.shoot_agent, arrow["id"], self.target.id, [0, 0, 0, 0],
+                                                                    self.aim_data(), settle_ticks=5))
+
+    def trajectory(self):
+        #Arrow and target rows of one full arrow flight towards the target
+        ages = np.arange(ARROW_FLIGHT)
+        times = self.clock.now - 0.05 * (ARROW_FLIGHT - ages)
+        arrow = np.column_stack((0.5 + 0.25 * ages, 5.6 + 0.5 * ages - 0.0125 * ages**2, 0.5 + 0.6 * ages, times))
+        target = np.column_stack((np.full(ARROW_FLIGHT, 10.0), np.full(ARROW_FLIGHT, 10.0), np.full(ARROW_FLIGHT, 25.0), times))
+        return arrow, target
+
+    def calls(self, stage):
+        '''
+        (setup, call) for one sample of a stage.  setup runs untimed and
+        returns the arguments of call.
+        '''
+        agent = self.shoot_agent
+        if stage == "set_obs":
+            def setup():
+                shooter, mover = self.advance()
+                return (shooter,)
+            return setup, agent.set_obs
+        if stage == "calculate_desired_aim":
+            def setup():
+                self.advance()
+                return (self.target.transform,)
+            return setup, agent.calculate_desired_aim
+        if stage == "desired_aim_refit":
+            def setup():
+                #One new row in every table, so each model takes an incremental update first
+                self.advance()
+                for table in ["vert_shots", "vert_leading", "hori_shots", "hori_leading"]:
+                    self.data_set.append(table, getattr(self.data_set, table)[self.tick % len(getattr(self.data_set, table))])
+                return (self.target.transform,)
+            return setup, agent.calculate_desired_aim
+        if stage == "track_arrows_step":
+            def setup():
+                shooter, mover = self.advance()
+                self.start_trackers(mover)
+                return (mover,)
+            return setup, agent.track_arrows_step
+        if stage == "analyze_arrow_trajectory":
+            def setup():
+                self.advance()
+                arrow, target = self.trajectory()
+                return (self.target.transform, arrow, target, [0.1, 0, 0.1, agent.transform["yaw"]], self.aim_data())
+            return setup, agent.analyze_arrow_trajectory
+        if stage == "shooter_step":
+            def setup():
+                #shooter_step reads the shooter's frame itself
+                shooter, mover = self.advance(shooter_sees=False)
+                return (shooter, self.move_agent, self.target)
+            return setup, agent.shooter_step
+        raise KeyError(stage)
+
+    def run(self, stage):
+        #{"p50": s, "p99": s, "peak": bytes} of a stage
+        setup, call = self.calls(stage)
+        for i in range(10):
+            call(*setup())
+        latencies = []
+        for i in range(self.samples):
+            args = setup()
+            start = time.perf_counter()
+            call(*args)
+            latencies.append(time.perf_counter() - start)
+        peaks = []
+        tracemalloc.start()
+        for i in range(self.allocation_samples):
+            args = setup()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            call(*args)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        p50, p99 = percentiles(latencies)
+        return {"p50": p50, "p99": p99, "peak": int(np.percentile(peaks, 50))}
+
+def case_name(case):
+    return "rows={rows} arrows={arrows} entities={entities}".format(**case)
+
+def cases(sweeps, trace):
+    #The default case, then one dimension varied at a time.  Trace frames fix arrows and entities
+    result = [dict(DEFAULT_CASE)]
+    for dimension, values in sweeps.items():
+        if trace is not None and dimension != "rows":
+            continue
+        for value in values:
+            case = dict(DEFAULT_CASE, **{dimension: value})
+            if case not in result:
+                result.append(case)
+    if trace is not None:
+        for case in result:
+            case["arrows"] = case["entities"] = "trace"
+    return result
+
+def run_suite(sweeps, samples, allocation_samples, trace=None):
+    rng = np.random.default_rng(0)
+    results = {}
+    print("{:<40} {:<26} {:>10} {:>10} {:>10}".format("case", "stage", "p50 (us)", "p99 (us)", "peak (KB)"))
+    for case in cases(sweeps, trace):
+        if trace is not None:
+            frames = trace_frames(trace, 2000)
+        else:
+            frames = synthetic_frames(rng, 2 * (ARROW_FLIGHT + 10), case["arrows"], case["entities"])
+        data_set = synthetic_data_set(rng, case["rows"])
+        results[case_name(case)] = {}
+        for stage in STAGES:
+            #A fresh runner per stage, so stages that record shots do not grow the next stage's data
+            runner = StageRunner(frames, data_set, samples, allocation_samples)
+            result = runner.run(stage)
+            results[case_name(case)][stage] = result
+            print("{:<40} {:<26} {:>10.1f} {:>10.1f} {:>10.1f}".format(case_name(case), stage, result["p50"] * 1e6, result["p99"] * 1e6, result["peak"] / 1024))
+            sys.stdout.flush()
+    return results
+
+def best_of(runs):
+    #Lowest value of every measure over several runs of the suite, which drops most scheduler noise
+    return {case: {stage: {measure: min(run[case][stage][measure] for run in runs) for measure in result}
+                   for stage, result in stages.items()} for case, stages in runs[0].items()}
+
+def regressions(results, baseline, tolerance):
+    #(case, stage, measure, baseline value, value) of every measure over the tolerance
+    found = []
+    limits = {"p50": tolerance, "p99": 2 * tolerance, "peak": tolerance}
+    for case, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(case, {}).get(stage)
+            if base is None:
+                continue
+            for measure, limit in limits.items():
+                #Timer noise and small allocations vary from run to run, so growth
+                #under 20 us or 1 KB never counts
+                slack = 1024 if measure == "peak" else 2e-5
+                if result[measure] > base[measure] * (1 + limit) + slack:
+                    found.append((case, stage, measure, base[measure], result[measure]))
+    return found
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage latency of one shooter tick")
+    parser.add_argument("--quick", action="store_true", help="smaller data sets and fewer samples")
+    parser.add_argument("--trace", help="take frames from a recorded trace")
+    parser.add_argument("--save", help="save the results to this baseline file")
+    parser.add_argument("--baseline", help="compare against this baseline file")
+    parser.add_argument("--check", help="quick runs compared against a quick baseline saved on this machine")
+    parser.add_argument("--repeat", type=int, help="run the suite this many times and keep the best of every measure, 3 with --check")
+    parser.add_argument("--tolerance", type=float, help="allowed growth over the baseline, 0.5 (50%%) by default and 1.0 with --check")
+    options = parser.parse_args()
+    if options.check:
+        options.quick = True
+        options.baseline = options.check
+        options.repeat = options.repeat or 3
+        options.tolerance = options.tolerance or 1.0
+    samples, allocation_samples = (200, 20) if options.quick else (1000, 50)
+    results = best_of([run_suite(QUICK_SWEEPS if options.quick else SWEEPS, samples, allocation_samples, options.trace)
+                       for i in range(options.repeat or 1)])
+    if options.save:
+        with open(options.save, "w") as file:
+            json.dump(results, file, indent=1, sort_keys=True)
+        print("Baseline saved to " + options.save)
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = json.load(file)
+        found = regressions(results, baseline, options.tolerance or 0.5)
+        for case, stage, measure, base, value in found:
+            print("REGRESSION {} {} {}: {:.6g} -> {:.6g}".format(case, stage, measure, base, value))
+        print("{} regressions against {}".format(len(found), options.baseline))
+        sys.exit(1 if found else 0)
@@ -1,14 +1,14 @@
-import time
+from clock import get_clock
 
 class TimeKeeper:
     def __init__(self):
         self.catchup()
 
     def advance_by(self, interval):
-        current_time = time.time()
+        current_time = get_clock().time()
         if current_time < self.current_time + interval:
-            time.sleep(current_time - self.current_time + interval)
+            get_clock().sleep(self.current_time + interval - current_time)
         self.current_time = max(self.current_time + interval, current_time)
 
     def catchup(self):
-        self.current_time = time.time()
+        self.current_time = get_clock().time()
@@ -0,0 +1,122 @@
+import threading
+import time
+import queue
+import numpy as np
+from collections import namedtuple
+from dataset import TABLES
+from regression import PitchLookupTable, LinearModel
+
+#Immutable set of models published by the trainer.  models maps (table, key) to a
+#LinearModel, pitch_lookups maps high_angle to a PitchLookupTable.  created is when
+#the snapshot was published, latency is the time from the request to publishing it
+ModelSnapshot = namedtuple("ModelSnapshot", ["models", "pitch_lookups", "versions", "created", "latency", "training_time"])
+
+class BackgroundTrainer():
+    '''
+    Fits the aim models on a worker thread so the tick loop never waits for a refit.
+    The tick loop calls update() with the DataSet, which sends the rows changed
+    since the last request to the worker.  The worker keeps its own incremental
+    regressions, solves them and publishes a new ModelSnapshot.  Readers keep
+    using the previous snapshot until the new one is swapped in.
+    '''
+
+    def __init__(self, table_models, refit_interval=1, lookup=None):
+        #table_models: {table: TableModel} owned by the worker from here on
+        #lookup: (bounds, resolution) to also build pitch lookup tables, or None
+        self.table_models = table_models
+        self.refit_interval = max(1, refit_interval)
+        self.lookup = lookup
+        self.snapshot = None
+        self._requested = dict.fromkeys(TABLES)
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def update(self, data_set):
+        #Request a refit if any table changed by at least refit_interval rows
+        versions = data_set.versions
+        if all(self._requested[table] is not None and 0 <= versions[table] - self._requested[table] < self.refit_interval for table in TABLES):
+            return False
+        job = {}
+        for table in TABLES:
+            changes = data_set.changes_since(table, self._requested[table])
+            if changes is None:
+                #Copy so the worker never reads a table the tick loop is writing
+                job[table] = (None, np.array(getattr(data_set, table), dtype=float))
+            else:
+                job[table] = (changes, None)
+        self._requested = dict(versions)
+        self._jobs.put((time.time(), dict(versions), job))
+        return True
+
+    def model(self, table, key=None):
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        return snapshot.models.get((table, key))
+
+    def pitch_lookup(self, high_angle):
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        return snapshot.pitch_lookups.get(high_angle)
+
+    def model_age(self):
+        #Seconds since the models in use were published
+        snapshot = self.snapshot
+        return None if snapshot is None else time.time() - snapshot.created
+
+    def wait(self):
+        #Block until every requested refit has been published
+        self._jobs.join()
+
+    def stop(self):
+        self._jobs.put(None)
+
+    def _run(self):
+        while True:
+            #Take every queued request at once and publish after applying them, so a
+            #queue that never empties still gets a fresh snapshot after each batch
+            items = [self._jobs.get()]
+            while items[-1] is not None:
+                try:
+                    items.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            jobs = [item for item in items if item is not None]
+            if jobs:
+                start = time.time()
+                for requested, versions, job in jobs:
+                    self._apply(versions, job)
+                #Latency is counted from the oldest request the snapshot covers
+                self._publish(jobs[0][0], jobs[-1][1], start)
+            for item in items:
+                self._jobs.task_done()
+            if items[-1] is None:
+                return
+
+    def _apply(self, versions, job):
+        for table, (changes, array) in job.items():
+            table_model = self.table_models[table]
+            if changes is None:
+                table_model.rebuild(array)
+            else:
+                for sign, rows in changes:
+                    table_model.apply(sign, rows)
+            table_model.version = versions[table]
+
+    def _publish(self, requested, versions, start):
+        models = {}
+        for table, table_model in self.table_models.items():
+            for key, regression in table_model.regressions.items():
+                solution = regression.solve()
+                if solution is not None:
+                    models[(table, key)] = LinearModel(table_model.expand, *solution)
+        pitch_lookups = {}
+        if self.lookup is not None:
+            bounds, resolution = self.lookup
+            for (table, key), model in models.items():
+                if table == "vert_shots":
+                    pitch_lookups[key] = PitchLookupTable(model, bounds[0], bounds[1], resolution)
+        now = time.time()
+        self.snapshot = ModelSnapshot(models, pitch_lookups, versions, now, now - requested, now - start)
@@ -0,0 +1,78 @@
+class Transform():
+    '''
+    Latest observation of an entity plus a short ring buffer of its past
+    (x, y, z, time) samples.  Indexing works like the entity dict, so
+    transform["x"] and transform["yaw"] come from the latest observation, and
+    motionX/Y/Z are computed on demand from the oldest and newest samples.
+    Until there are two samples, motion comes from the observation itself.
+    With an estimator (see estimator.py) every sample is also fed to it and
+    motion comes from its filtered velocity instead of the finite difference.
+    Example:
+        transform = Transform()
+        transform.update(entity, obs["time"])
+        velocity = (transform["motionX"], transform["motionY"], transform["motionZ"])
+    '''
+    __slots__ = ("entity", "estimator", "_samples", "_head", "_count", "_size")
+
+    def __init__(self, history=5, estimator=None):
+        #history includes the current sample, so 5 spans the last 4 ticks
+        self.entity = None
+        self.estimator = estimator
+        self._size = history
+        self._samples = [0.0] * (4 * history)
+        self._head = 0
+        self._count = 0
+
+    def update(self, entity, time):
+        self.entity = entity
+        start = self._head * 4
+        self._samples[start:start + 4] = (entity["x"], entity["y"], entity["z"], time)
+        self._head = (self._head + 1) % self._size
+        self._count = min(self._count + 1, self._size)
+        if self.estimator is not None:
+            self.estimator.update((entity["x"], entity["y"], entity["z"]), time)
+        return self
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+        if self.estimator is not None:
+            self.estimator.reset()
+
+    def sample(self, age):
+        #(x, y, z, time) from age updates ago, where 0 is the newest
+        start = ((self._head - 1 - age) % self._size) * 4
+        return self._samples[start:start + 4]
+
+    def __len__(self):
+        return self._count
+
+    def velocity(self):
+        #Filtered velocity, or the finite difference between the oldest and newest samples, or None
+        if self._count < 2:
+            return None
+        if self.estimator is not None:
+            return self.estimator.velocity
+        newest = self.sample(0)
+        oldest = self.sample(self._count - 1)
+        elapsed = newest[3] - oldest[3]
+        if elapsed <= 0:
+            return None
+        return ((newest[0] - oldest[0]) / elapsed, (newest[1] - oldest[1]) / elapsed, (newest[2] - oldest[2]) / elapsed)
+
+    def __getitem__(self, key):
+        if key == "time":
+            return self.sample(0)[3]
+        if key in MOTION_KEYS:
+            velocity = self.velocity()
+            if velocity is not None:
+                return velocity[MOTION_KEYS[key]]
+        return self.entity[key]
+
+    def __contains__(self, key):
+        return key == "time" or key in MOTION_KEYS or key in self.entity
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+MOTION_KEYS = {"motionX": 0, "motionY": 1, "motionZ": 2}